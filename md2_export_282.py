@@ -34,9 +34,18 @@ from bpy_extras.io_utils import ExportHelper
 
 from math import pi
 import mathutils
+import numpy as np
 
 import struct
-import random
+import copy
+import hashlib
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import os
 import shutil
 
@@ -203,24 +212,367 @@ MD2_NORMALS = ((-0.525731, 0.000000, 0.850651),
                (-0.587785, -0.425325, -0.688191),
                (-0.688191, -0.587785, -0.425325))
 
+# components of MD2_NORMALS as (1, 162) rows, used to look up the normals of a whole mesh at once
+MD2_NORMALS_X, MD2_NORMALS_Y, MD2_NORMALS_Z = np.array(MD2_NORMALS, dtype=np.float64).T[:, np.newaxis, :]
+
+# size of the (LRU) post-transform vertex cache the triangle order is optimized for and measured with
+VERTEX_CACHE_SIZE = 32
+
+# the vertex and texture coordinate indices of the MD2 triangles are unsigned shorts
+MD2_MAX_VERTICES = 2 ** 16
+MD2_MAX_TEXTURE_COORDINATES = 2 ** 16
+
+# on-disk layout of the static MD2 sections (all little-endian), every section is encoded with one tobytes()
+MD2_HEADER_DTYPE = np.dtype([('ident', 'S4'),
+                             ('version', '<i4'),
+                             ('skin_width', '<i4'),
+                             ('skin_height', '<i4'),
+                             ('frame_size', '<i4'),
+                             ('num_skins', '<i4'),
+                             ('num_xyz', '<i4'),
+                             ('num_st', '<i4'),
+                             ('num_tris', '<i4'),
+                             ('num_gl_commands', '<i4'),
+                             ('num_frames', '<i4'),
+                             ('ofs_skins', '<i4'),
+                             ('ofs_st', '<i4'),
+                             ('ofs_tris', '<i4'),
+                             ('ofs_frames', '<i4'),
+                             ('ofs_gl_commands', '<i4'),
+                             ('ofs_end', '<i4')])
+MD2_SKIN_DTYPE = np.dtype('S64')
+MD2_ST_DTYPE = np.dtype([('s', '<i2'), ('t', '<i2')])
+MD2_TRIANGLE_DTYPE = np.dtype([('vertices', '<u2', 3), ('st', '<u2', 3)])
+# a GL command is a '<i' count followed by |count| of these vertices
+MD2_GL_VERTEX_DTYPE = np.dtype([('s', '<f4'), ('t', '<f4'), ('vertex', '<u4')])
+
+
+# contiguous copy of everything the writer stages need from the (triangulated) meshes of the export. The data is
+# read once per mesh with foreach_get and the meshes are merged: vertex and loop indices are offset accordingly.
+class MeshSnapshot:
+    def __init__(self, meshes):
+        positions, normals = Util.get_vertex_arrays(meshes)
+        self.positions = positions  # (vertices, 3)
+        self.normals = normals  # (vertices, 3)
+
+        triangle_vertices = []
+        triangle_loops = []
+        triangle_objects = []
+        uvs = []
+        vertices_index = 0
+        loops_index = 0
+        for mesh in meshes:
+            num_triangles = len(mesh.loop_triangles)
+            vertices = np.empty(num_triangles * 3, dtype=np.int32)
+            loops = np.empty(num_triangles * 3, dtype=np.int32)
+            mesh.loop_triangles.foreach_get('vertices', vertices)
+            mesh.loop_triangles.foreach_get('loops', loops)
+            triangle_vertices.append(vertices + vertices_index)
+            triangle_loops.append(loops + loops_index)
+            triangle_objects.append(np.full(num_triangles, len(triangle_objects), dtype=np.int32))
+
+            # meshes without uv layer get (0, 0) everywhere
+            mesh_uvs = np.zeros(len(mesh.loops) * 2, dtype=np.float32)
+            if len(mesh.uv_layers) != 0:
+                mesh.uv_layers[0].data.foreach_get('uv', mesh_uvs)
+            uvs.append(mesh_uvs)
+
+            vertices_index += len(mesh.vertices)
+            loops_index += len(mesh.loops)
+
+        self.triangle_vertices = np.concatenate(triangle_vertices or [[]]).astype(np.int64).reshape(-1, 3)
+        self.triangle_loops = np.concatenate(triangle_loops or [[]]).astype(np.int64).reshape(-1, 3)
+        # index of the mesh of every triangle
+        self.triangle_objects = np.concatenate(triangle_objects or [[]]).astype(np.int32)
+        self.uvs = np.concatenate(uvs or [[]]).astype(np.float32).reshape(-1, 2)  # (loops, 2)
+        # uv of every triangle corner, (triangles, 3, 2)
+        self.triangle_uvs = self.uvs[self.triangle_loops]
+
+        self.num_vertices = len(self.positions)
+        self.num_triangles = len(self.triangle_vertices)
+        # vertices of every mesh, the positions of the meshes follow each other
+        self.mesh_vertex_counts = [len(mesh.vertices) for mesh in meshes]
+
+        # snapshot vertex index -> index in the evaluated meshes, None while the vertices are not reordered
+        self.vertex_order = None
+
+    # bytes held by the arrays of the snapshot
+    def get_size(self):
+        arrays = (self.positions, self.normals, self.triangle_vertices, self.triangle_loops, self.triangle_objects,
+                  self.uvs, self.triangle_uvs, self.vertex_order)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    # returns a snapshot of the given triangles with the vertices they use only, its vertex order maps to the
+    # vertices of the evaluated meshes
+    def get_part(self, triangles):
+        part = copy.copy(self)
+        (vertices, inverse) = np.unique(self.triangle_vertices[triangles], return_inverse=True)
+        part.triangle_vertices = inverse.reshape(-1, 3).astype(np.int64)
+        part.triangle_loops = self.triangle_loops[triangles]
+        part.triangle_objects = self.triangle_objects[triangles]
+        part.triangle_uvs = self.triangle_uvs[triangles]
+        part.positions = self.positions[vertices]
+        part.normals = self.normals[vertices]
+        part.vertex_order = vertices if self.vertex_order is None else self.vertex_order[vertices]
+        part.num_vertices = len(vertices)
+        part.num_triangles = len(part.triangle_vertices)
+        part.mesh_vertex_counts = None
+        return part
+
+    # reorders the triangles for the vertex cache and renumbers the vertices in order of their first use, so
+    # the frame vertices are laid out like they are fetched. Returns the ACMR before and after
+    def optimize_vertex_cache(self):
+        acmr_before = Util.compute_acmr(self.triangle_vertices.tolist())
+
+        order = np.array(Util.optimize_triangle_order(self.triangle_vertices.tolist(), self.num_vertices),
+                         dtype=np.int64)
+        self.triangle_vertices = self.triangle_vertices[order]
+        self.triangle_loops = self.triangle_loops[order]
+        self.triangle_objects = self.triangle_objects[order]
+        self.triangle_uvs = self.triangle_uvs[order]
+
+        # vertices in order of first use, vertices without triangle at the end
+        used = self.triangle_vertices.reshape(-1)
+        (_, first) = np.unique(used, return_index=True)
+        used = used[np.sort(first)]
+        vertex_order = np.concatenate([used, np.setdiff1d(np.arange(self.num_vertices), used)])
+        new_index = np.empty(self.num_vertices, dtype=np.int64)
+        new_index[vertex_order] = np.arange(self.num_vertices)
+
+        self.triangle_vertices = new_index[self.triangle_vertices]
+        self.positions = self.positions[vertex_order]
+        self.normals = self.normals[vertex_order]
+        self.vertex_order = vertex_order if self.vertex_order is None else self.vertex_order[vertex_order]
+
+        return acmr_before, Util.compute_acmr(self.triangle_vertices.tolist())
+
+
+# Linear blend skinning of a mesh whose only deformation is an armature modifier. The rest positions, the vertex
+# group weights and the topology are captured once: a frame then only needs the pose bone matrices instead of a
+# complete evaluation of the mesh. The vertex normals are recomputed from the skinned positions the way Blender does
+# (polygon normals weighted by the corner angles), so the result matches the evaluated mesh.
+class ArmatureSkin:
+    # weights below are ignored by Blender
+    MIN_CONTRIBUTION = 0.0001
+
+    def __init__(self, obj, modifier):
+        self.obj = obj
+        self.modifier = modifier
+        self.armature = armature = modifier.object
+        mesh = obj.data
+
+        self.rest_co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', self.rest_co)
+        self.rest_co = self.rest_co.reshape(-1, 3).astype(np.float64)
+
+        # bones which deform through a vertex group of the mesh
+        deform_bones = {bone.name for bone in armature.data.bones if bone.use_deform}
+        group_bones = [group.name if group.name in deform_bones else None for group in obj.vertex_groups]
+        self.bone_names = sorted({name for name in group_bones if name is not None})
+        bone_indices = {name: i for i, name in enumerate(self.bone_names)}
+        self.rest_inverse = np.array([np.array(armature.data.bones[name].matrix_local.inverted())
+                                      for name in self.bone_names]).reshape(-1, 4, 4)
+
+        # influences of every vertex, padded with the last matrix (no deformation) and a zero weight
+        influences = []
+        for vertex in mesh.vertices:
+            influences.append([(bone_indices[group_bones[element.group]], element.weight) for element in vertex.groups
+                               if group_bones[element.group] is not None and element.weight > 0.0])
+        width = max([len(influence) for influence in influences] + [1])
+        self.bones = np.full((len(influences), width), len(self.bone_names), dtype=np.int64)
+        self.weights = np.zeros((len(influences), width))
+        for i, influence in enumerate(influences):
+            contribution = sum(weight for _, weight in influence)
+            if contribution > ArmatureSkin.MIN_CONTRIBUTION:
+                self.bones[i, :len(influence)] = [bone for bone, _ in influence]
+                self.weights[i, :len(influence)] = [weight / contribution for _, weight in influence]
+            else:
+                # not deformed
+                self.weights[i, 0] = 1.0
+
+        self.polygon_loops = Util.get_polygon_loops(mesh)
+
+    # the pose is evaluated by the depsgraph
+    def needs_scene(self):
+        return True
+
+    # while the frames are sampled, the armature modifier is disabled: a frame change then only evaluates the pose
+    # and not the skinning of the mesh too. Not if other objects use the deformed mesh, they would see it in rest pose.
+    # Returns whether the modifier is disabled
+    def suspend(self):
+        dependents = Util.get_dependents(self.obj, bpy.context.scene.objects)
+        if dependents:
+            print("Armature modifier of %s kept enabled, the deformed mesh is used by %s" % (
+                self.obj.name, ', '.join(obj.name for obj in dependents)))
+            return False
+        self.modifier.show_viewport = False
+        return True
+
+    def resume(self):
+        self.modifier.show_viewport = True
+
+    # returns an ArmatureSkin of the object or None (with the reason printed) if its deformation is not supported
+    @staticmethod
+    def create(obj):
+        modifiers = [modifier for modifier in obj.modifiers if modifier.show_viewport]
+        if len(modifiers) != 1 or modifiers[0].type != 'ARMATURE':
+            reason = "it has other modifiers than an armature modifier"
+        elif modifiers[0].object is None or modifiers[0].object.type != 'ARMATURE':
+            reason = "the armature modifier has no armature"
+        elif (modifiers[0].use_deform_preserve_volume or modifiers[0].use_bone_envelopes or
+              modifiers[0].use_multi_modifier or not modifiers[0].use_vertex_groups or modifiers[0].vertex_group):
+            reason = "the armature modifier only supports vertex groups without preserve volume or mask"
+        elif modifiers[0].object.data.pose_position != 'POSE':
+            reason = "the armature is in rest position"
+        elif any(bone.use_deform and bone.bbone_segments > 1 for bone in modifiers[0].object.data.bones):
+            reason = "it is deformed by bendy bones"
+        elif obj.data.shape_keys is not None:
+            reason = "it has shape keys"
+        elif len(obj.constraints) != 0:
+            reason = "it has constraints"
+        else:
+            return ArmatureSkin(obj, modifiers[0])
+
+        print("Armature deformation of %s evaluated by Blender: %s" % (obj.name, reason))
+        return None
+
+    # returns the skinned vertex positions (transformed by matrix, in object space if None) and the vertex normals
+    # (in object space, None if normals is False) at the current frame of the scene
+    def sample(self, depsgraph, frame, matrix=None, normals=True):
+        obj_eval = self.obj.evaluated_get(depsgraph)
+        armature_eval = self.armature.evaluated_get(depsgraph)
+        pose_bones = armature_eval.pose.bones
+        pose = np.array([np.array(pose_bones[name].matrix) for name in self.bone_names]).reshape(-1, 4, 4)
+
+        # the armature deforms in its own space: object space -> armature space -> posed -> object space
+        object_to_armature = np.linalg.inv(np.array(armature_eval.matrix_world)) @ np.array(obj_eval.matrix_world)
+        deform = np.linalg.inv(object_to_armature) @ pose @ self.rest_inverse @ object_to_armature
+        deform = np.concatenate((deform[:, :3], np.eye(4)[None, :3]))
+
+        blend = np.einsum('vk,vkij->vij', self.weights, deform[self.bones])
+        co = np.einsum('vij,vj->vi', blend[:, :, :3], self.rest_co) + blend[:, :, 3]
+        vertex_normals = None
+        if normals:
+            vertex_normals = Util.compute_vertex_normals(co, *self.polygon_loops).astype(np.float32)
+
+        if matrix is not None:
+            transform = np.array(matrix) @ np.array(obj_eval.matrix_world)
+            co = co @ transform[:3, :3].T + transform[:3, 3]
+        return co.astype(np.float32), vertex_normals
+
+
+# Relative shape keys animated by fcurves, on a mesh without modifiers. The key blocks are read once into a
+# (keys, vertices * 3) array of offsets: a frame only needs the values of the keys, evaluated from their fcurves, and
+# one matrix product. The vertex normals are recomputed from the positions like for the ArmatureSkin. If the transform
+# of the object is not animated, the scene is not evaluated at all.
+class ShapeKeyAnimation:
+    def __init__(self, obj):
+        self.obj = obj
+        mesh = obj.data
+        key = mesh.shape_keys
+        num_values = len(mesh.vertices) * 3
+
+        def get_co(block):
+            co = np.empty(num_values, dtype=np.float32)
+            block.data.foreach_get('co', co)
+            return co.astype(np.float64)
+
+        block_co = {block.name: get_co(block) for block in key.key_blocks}
+        self.basis = block_co[key.reference_key.name]
+
+        # every key moves the mesh by its offset to its relative key, weighted by its value
+        blocks = [block for block in key.key_blocks if block != key.reference_key and not block.mute]
+        self.offsets = np.array([block_co[block.name] - block_co[block.relative_key.name]
+                                 for block in blocks]).reshape(-1, num_values)
+        self.value_ranges = [(block.slider_min, block.slider_max) for block in blocks]
+
+        # fcurve of the value of every key, the keys without fcurve (or with a muted one) keep their value
+        fcurves = {}
+        if key.animation_data is not None and key.animation_data.action is not None:
+            fcurves = {fcurve.data_path: fcurve for fcurve in key.animation_data.action.fcurves if not fcurve.mute}
+        self.fcurves = [fcurves.get('key_blocks["%s"].value' % block.name) for block in blocks]
+        self.values = [block.value for block in blocks]
+
+        self.polygon_loops = Util.get_polygon_loops(mesh)
+        # the transform of the object is constant without animation (action, NLA or drivers), parent or constraints
+        self.static_transform = (obj.parent is None and len(obj.constraints) == 0 and
+                                 (obj.animation_data is None or (obj.animation_data.action is None and
+                                                                 len(obj.animation_data.drivers) == 0 and
+                                                                 len(obj.animation_data.nla_tracks) == 0)))
+
+    def needs_scene(self):
+        return not self.static_transform
+
+    # the shape keys have nothing to disable
+    def suspend(self):
+        return False
+
+    def resume(self):
+        pass
+
+    # returns a ShapeKeyAnimation of the object or None (with the reason printed) if its deformation is not supported
+    @staticmethod
+    def create(obj):
+        key = obj.data.shape_keys
+        animation = key.animation_data if key is not None else None
+        if key is None:
+            reason = "it has no shape keys"
+        elif any(modifier.show_viewport for modifier in obj.modifiers):
+            reason = "it has modifiers"
+        elif not key.use_relative:
+            reason = "the shape keys are absolute"
+        elif obj.show_only_shape_key:
+            reason = "the active shape key is pinned"
+        elif any(block.vertex_group for block in key.key_blocks):
+            reason = "a shape key is limited to a vertex group"
+        elif animation is not None and (len(animation.drivers) != 0 or len(animation.nla_tracks) != 0):
+            reason = "the shape keys are driven or use NLA tracks"
+        elif animation is not None and animation.action is not None and any(
+                not (fcurve.data_path.startswith('key_blocks[') and fcurve.data_path.endswith('].value'))
+                for fcurve in animation.action.fcurves):
+            reason = "other shape key properties than the values are animated"
+        else:
+            return ShapeKeyAnimation(obj)
+
+        print("Shape keys of %s evaluated by Blender: %s" % (obj.name, reason))
+        return None
+
+    # returns the vertex positions (transformed by matrix, in object space if None) and the vertex normals (in object
+    # space, None if normals is False) at the given frame (None: the current frame of the scene)
+    def sample(self, depsgraph, frame, matrix=None, normals=True):
+        if frame is None:
+            frame = bpy.context.scene.frame_current
+        values = np.array([min(max(fcurve.evaluate(frame), value_range[0]), value_range[1]) if fcurve else value
+                           for fcurve, value, value_range in zip(self.fcurves, self.values, self.value_ranges)])
+        co = (self.basis + values @ self.offsets).reshape(-1, 3)
+
+        vertex_normals = None
+        if normals:
+            vertex_normals = Util.compute_vertex_normals(co, *self.polygon_loops).astype(np.float32)
+
+        if matrix is not None:
+            obj = self.obj if self.static_transform else self.obj.evaluated_get(depsgraph)
+            transform = np.array(matrix) @ np.array(obj.matrix_world)
+            co = co @ transform[:3, :3].T + transform[:3, 3]
+        return co.astype(np.float32), vertex_normals
+
+
+# the classes evaluating the deformation of an object without Blender, by name
+SAMPLER_TYPES = {cls.__name__: cls for cls in (ArmatureSkin, ShapeKeyAnimation)}
+
 
 class MD2Header:
-    def __init__(self, skins, meshes, num_frames):
-        self.version = 8
+    skin_width = 2 ** 10 - 1  # 1023
+    skin_height = 2 ** 10 - 1  # 1023
 
-        self.skin_width = 2 ** 10 - 1  # 1023
-        self.skin_height = 2 ** 10 - 1  # 1023
+    def __init__(self, skins, snapshot, num_frames, num_st, num_gl_commands):
+        self.version = 8
 
         self.num_skins = len(skins)
-        self.num_xyz = 0
-        self.num_st = 0
-        self.num_tris = 0
-        for mesh in meshes:
-            self.num_xyz += len(mesh.vertices)
-            self.num_st += len(mesh.loop_triangles) * 3
-            self.num_tris += len(mesh.loop_triangles)
-        print(self.num_tris)
-        self.num_gl_commands = self.num_tris * (1 + 3 * 3) + 1
+        self.num_xyz = snapshot.num_vertices
+        self.num_st = num_st
+        self.num_tris = snapshot.num_triangles
+        self.num_gl_commands = num_gl_commands
 
         self.num_frames = num_frames
 
@@ -233,30 +585,431 @@ class MD2Header:
         self.ofs_gl_commands = self.ofs_frames + self.frame_size * self.num_frames
         self.ofs_end = self.ofs_gl_commands + 4 * self.num_gl_commands
 
-    def write(self, file):
+    # offset of the frame block with the given index
+    def get_frame_offset(self, index):
+        return self.ofs_frames + index * self.frame_size
+
+    def write(self, buffer):
         # write header
-        pack = struct.pack('<4B16i',  # bin = struct.pack('<4s16i',
-                           ord('I'),
-                           ord('D'),
-                           ord('P'),
-                           ord('2'),
-                           self.version,
-                           self.skin_width,
-                           self.skin_height,
-                           self.frame_size,
-                           self.num_skins,
-                           self.num_xyz,
-                           self.num_st,  # number of texture coordinates
-                           self.num_tris,
-                           self.num_gl_commands,
-                           self.num_frames,
-                           self.ofs_skins,
-                           self.ofs_st,
-                           self.ofs_tris,
-                           self.ofs_frames,
-                           self.ofs_gl_commands,
-                           self.ofs_end)
-        file.write(pack)
+        header = np.zeros(1, dtype=MD2_HEADER_DTYPE)
+        header['ident'] = b'IDP2'
+        for name in MD2_HEADER_DTYPE.names[1:]:
+            header[name] = getattr(self, name)
+        buffer[0:MD2_HEADER_DTYPE.itemsize] = header.tobytes()
+
+
+# the texture coordinate (ST) table and the ST index of every triangle corner (in loop order). Without merging
+# every triangle gets its own three entries (uv index is : face.index*3+i), with merging identical (s, t) pairs
+# are stored only once.
+class MD2TextureCoordinates:
+    def __init__(self, snapshot, merge=False):
+        st = Util.check_range(MD2TextureCoordinates.get_st(snapshot.triangle_uvs.reshape(-1, 2)), 'h')
+
+        if merge and len(st) != 0:
+            (unique_st, first, inverse) = np.unique(st, axis=0, return_index=True, return_inverse=True)
+            # keep the entries in the order of their first use
+            order = np.argsort(first)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            self.st = unique_st[order]
+            self.indices = rank[inverse.reshape(-1)]
+        else:
+            self.st = st
+            self.indices = np.arange(len(st))
+
+        self.num_st = len(self.st)
+
+    # returns the (s, t) pairs of the given (n, 2) uvs
+    @staticmethod
+    def get_st(uvs):
+        uvs = uvs.astype(np.float64)
+        # (u,v) in blender -> (u,1-v), int() truncates towards zero
+        st = np.empty((len(uvs), 2), dtype=np.int64)
+        st[:, 0] = uvs[:, 0] * MD2Header.skin_width
+        st[:, 1] = (1 - uvs[:, 1]) * MD2Header.skin_height
+        return st
+
+    # returns one integer per (s, t) pair, equal for identical pairs: the pairs merged by the table are counted with it
+    @staticmethod
+    def get_keys(st):
+        return st[:, 0] * 2 ** 32 + st[:, 1]
+
+    def write(self, buffer):
+        st = np.empty(self.num_st, dtype=MD2_ST_DTYPE)
+        st['s'] = self.st[:, 0]
+        st['t'] = self.st[:, 1]
+        buffer[:] = st.tobytes()  # uv
+
+
+# triangle strips and fans of the GL command list, built like the original Quake2 tools do (qdata's BuildGlCmds):
+# starting at every unused triangle, the longest strip or fan over edges that share vertices and texture
+# coordinates is taken, so strips never cross UV seams.
+class MD2GLCommands:
+    def __init__(self, snapshot):
+        # every command is (count, [corner, ...]), count > 0 for strips and < 0 for fans
+        self.commands = []
+
+        # a corner is a vertex with its texture coordinate, identical corners share one key.
+        # 0,2,1 for good cw/ccw (also flips/inverts normal)
+        corners = np.empty(snapshot.num_triangles * 3, dtype=MD2_GL_VERTEX_DTYPE)
+        corners['s'] = snapshot.triangle_uvs[:, [0, 2, 1], 0].reshape(-1)
+        corners['t'] = snapshot.triangle_uvs[:, [0, 2, 1], 1].reshape(-1)
+        corners['vertex'] = snapshot.triangle_vertices[:, [0, 2, 1]].reshape(-1)
+        if len(corners) != 0:
+            (self.corners, keys) = np.unique(corners, return_inverse=True)
+        else:
+            (self.corners, keys) = (corners, np.empty(0, dtype=np.int64))
+
+        self.build(keys.reshape(-1, 3).tolist())
+
+        self.num_strips = sum(1 for count, _ in self.commands if count > 0)
+        self.num_fans = len(self.commands) - self.num_strips
+        num_triangles = sum(len(corners) - 2 for _, corners in self.commands)
+        self.average_length = num_triangles / len(self.commands) if self.commands else 0.0
+
+        # count + (s, t, vertex index) per corner for each command, NULL command at the end
+        self.num_gl_commands = sum(1 + 3 * len(corners) for _, corners in self.commands) + 1
+
+    def build(self, triangles):
+        # directed edge (corner, next corner) -> [(triangle, index of the corner in the triangle)]
+        edges = {}
+        for i, tri in enumerate(triangles):
+            for k in range(3):
+                edges.setdefault((tri[k], tri[(k + 1) % 3]), []).append((i, k))
+
+        used = [False] * len(triangles)
+        for i in range(len(triangles)):
+            # pick an unused triangle and start the strip/fan
+            if used[i]:
+                continue
+
+            best_corners, best_tris, best_is_fan = None, None, False
+            for is_fan in (False, True):
+                for start_vertex in range(3):
+                    corners, tris = MD2GLCommands.grow(triangles, edges, used, i, start_vertex, is_fan)
+                    if best_tris is None or len(tris) > len(best_tris):
+                        best_corners, best_tris, best_is_fan = corners, tris, is_fan
+
+            # mark the triangles of the best strip/fan as used
+            for j in best_tris:
+                used[j] = True
+            count = len(best_corners)
+            self.commands.append((-count if best_is_fan else count, best_corners))
+
+    @staticmethod
+    def grow(triangles, edges, used, start, start_vertex, is_fan):
+        tri = triangles[start]
+        corners = [tri[start_vertex % 3], tri[(start_vertex + 1) % 3], tri[(start_vertex + 2) % 3]]
+        tris = [start]
+        in_strip = {start}
+
+        # the edge the next triangle has to share (in its own winding)
+        if is_fan:
+            m1, m2 = corners[0], corners[2]
+        else:
+            m1, m2 = corners[2], corners[1]
+
+        while True:
+            candidates = [(j, k) for j, k in edges.get((m1, m2), ()) if not used[j] and j not in in_strip]
+            if not candidates:
+                break
+            j, k = candidates[0]
+
+            # the new edge
+            new_corner = triangles[j][(k + 2) % 3]
+            if is_fan or len(tris) & 1:
+                m2 = new_corner
+            else:
+                m1 = new_corner
+
+            corners.append(new_corner)
+            tris.append(j)
+            in_strip.add(j)
+        return corners, tris
+
+    def write(self, buffer):
+        counts = np.array([count for count, _ in self.commands], dtype=np.int64)
+        keys = np.array([key for _, corners in self.commands for key in corners], dtype=np.int64)
+
+        vertices = np.empty(len(keys), dtype=MD2_GL_VERTEX_DTYPE)
+        # (u,v) in blender -> (u,1-v)
+        vertices['s'] = self.corners['s'][keys]
+        vertices['t'] = 1.0 - self.corners['t'][keys].astype(np.float64)
+        vertices['vertex'] = self.corners['vertex'][keys]
+
+        # every command takes one slot for its count and three for each of its vertices
+        sizes = 1 + 3 * np.abs(counts)
+        commands = np.empty(self.num_gl_commands, dtype='<i4')
+        is_vertex = np.ones(self.num_gl_commands, dtype=bool)
+        count_slots = np.cumsum(sizes) - sizes
+        commands[count_slots] = counts
+        is_vertex[count_slots] = False
+        # NULL command
+        commands[-1] = 0
+        is_vertex[-1] = False
+        commands[is_vertex] = vertices.view('<i4')
+
+        buffer[:] = commands.tobytes()
+
+
+# the sections of an MD2 file which do not depend on the frames (skins, texture coordinates, triangles and GL
+# commands), encoded once for all files of an export
+class MD2StaticSections:
+    def __init__(self, skins, skin_names, snapshot, texture_coordinates, gl_commands):
+        self.skins = skins
+        self.snapshot = snapshot
+        self.num_st = texture_coordinates.num_st
+        self.num_gl_commands = gl_commands.num_gl_commands
+
+        layout = self.create_header(0)
+        # skins, texture coordinates and triangles follow each other
+        self.sections = bytearray(layout.ofs_frames - layout.ofs_skins)
+        view = memoryview(self.sections)
+        view[:layout.ofs_st - layout.ofs_skins] = skin_names
+        texture_coordinates.write(view[layout.ofs_st - layout.ofs_skins:layout.ofs_tris - layout.ofs_skins])
+        MD2.write_triangles(view[layout.ofs_tris - layout.ofs_skins:], snapshot, texture_coordinates.indices)
+        self.gl_section = bytearray(layout.ofs_end - layout.ofs_gl_commands)
+        gl_commands.write(memoryview(self.gl_section))
+
+    def create_header(self, num_frames):
+        return MD2Header(self.skins, self.snapshot, num_frames, self.num_st, self.num_gl_commands)
+
+    # writes the header and the static sections into a file
+    def write(self, file, header):
+        header_section = bytearray(header.ofs_skins)
+        header.write(memoryview(header_section))
+        file.write(0, header_section)
+        file.write(header.ofs_skins, self.sections)
+        file.write(header.ofs_gl_commands, self.gl_section)
+
+
+# An MD2 file written in place: the encoder threads write every frame block at its offset as soon as it is encoded,
+# the header and the static sections are written once the number of frames is known. Only the frames being encoded are
+# held in memory, not an image of the whole file
+class MD2File:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.lock = threading.Lock()
+
+    # the encoder threads write concurrently
+    def write(self, offset, data):
+        with self.lock:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    # closes and deletes the incomplete file of a failed export
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+# Frame reduction: drops frames that the linear interpolation between the kept neighbours reproduces within
+# tolerance, measured in quantization steps of the given bounding box. The first and last frame of every clip (frames
+# of the same timeline marker) are always kept, so the marker based animation names stay valid.
+# Frames are added in order and returned as soon as it is known that they are kept. The dropped frames since the
+# last kept one are held to check the interpolation error, at most window of them: a full window keeps a frame.
+class FrameDecimator:
+    def __init__(self, bbox_min, bbox_max, tolerance, window=None):
+        extent = np.array(bbox_max, dtype=np.float64) - np.array(bbox_min, dtype=np.float64)
+        self.steps = 255.0 / np.where(extent > 0, extent, 1.0)
+        self.tolerance = tolerance
+        self.window = window
+        # last kept frame, (frame, co)
+        self.anchor = None
+        # frames after the anchor as (frame, co, normal indices): the last one is undecided, the others are dropped
+        self.pending = []
+        # clips of the last added frame and of the frame before it
+        self.previous_clip = None
+        self.clip_before_last = None
+
+    def get_num_held(self):
+        return len(self.pending) + (self.anchor is not None)
+
+    # can all pending frames be interpolated between the anchor and the given frame?
+    def fits(self, frame, co):
+        (anchor_frame, anchor_co) = self.anchor
+        start_co = anchor_co.astype(np.float64)
+        end_co = co.astype(np.float64)
+        duration = frame[0] - anchor_frame[0]
+        for pending_frame, pending_co, _ in self.pending:
+            t = (pending_frame[0] - anchor_frame[0]) / duration
+            error = np.abs((start_co + (end_co - start_co) * t - pending_co) * self.steps)
+            if error.size and error.max() > self.tolerance:
+                return False
+        return True
+
+    # adds the next frame, returns the frames which are now known to be kept as [(frame, co, normal indices)]
+    def add(self, frame, co, normal_indices):
+        if self.anchor is None:
+            self.anchor = (frame, co)
+            self.previous_clip = frame[1]
+            return [(frame, co, normal_indices)]
+
+        kept = []
+        if self.pending:
+            (last_frame, last_co, _) = self.pending[-1]
+            if (last_frame[1] != self.clip_before_last or last_frame[1] != frame[1] or
+                    (self.window is not None and len(self.pending) >= self.window) or
+                    not self.fits(frame, co)):
+                kept.append(self.pending[-1])
+                self.anchor = (last_frame, last_co)
+                self.pending = []
+
+        self.clip_before_last = self.previous_clip
+        self.previous_clip = frame[1]
+        self.pending.append((frame, co, normal_indices))
+        return kept
+
+    # the last frame is always kept
+    def finish(self):
+        kept = self.pending[-1:]
+        self.pending = []
+        return kept
+
+
+# Runs the normal lookup and the encoding of the frames on a thread pool while the main thread, the only one allowed
+# to evaluate the scene, samples the next frames. NumPy releases the GIL during the heavy operations. At most
+# queue_size jobs are queued or running: submit blocks while the queue is full. A job may wait for the result of an
+# earlier job only, the jobs start in order
+class FrameEncoder:
+    def __init__(self, num_threads=None, queue_size=None):
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.queue_size = queue_size or 2 * self.num_threads
+        self.slots = threading.BoundedSemaphore(self.queue_size)
+        self.executor = ThreadPoolExecutor(self.num_threads)
+        self.futures = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown(wait=True)
+        return False
+
+    def submit(self, function, *args):
+        # errors of the finished jobs are raised as early as possible
+        while self.futures and self.futures[0].done():
+            self.futures.popleft().result()
+
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    # returns a finished future of value, for samples whose normal indices are already known
+    @staticmethod
+    def get_done_future(value):
+        future = Future()
+        future.set_result(value)
+        return future
+
+    # waits for all submitted jobs, raises the error of the first failed one
+    def join(self):
+        while self.futures:
+            self.futures.popleft().result()
+
+
+# Copies the textures next to the exported files on a thread pool, while the geometry is encoded. Every destination
+# is copied once per export. A copy is skipped if the destination already has the size and modification time of the
+# source (copies keep the modification time) or, failing that, the same content
+class TextureDeployment:
+    def __init__(self, num_threads=4):
+        self.executor = ThreadPoolExecutor(num_threads)
+        # destination -> (source, destination, future of the copy)
+        self.copies = {}
+
+    def deploy(self, source, destination):
+        source = os.path.abspath(source)
+        destination = os.path.abspath(destination)
+        key = os.path.normcase(destination)
+        if key in self.copies:
+            if self.copies[key][0] != source:
+                print("Texture %s is not copied, %s is copied to %s already." % (source, self.copies[key][0],
+                                                                               destination))
+            return
+        self.copies[key] = (source, destination, self.executor.submit(TextureDeployment.copy, source, destination))
+
+    # copies source to destination unless it is up to date, returns whether the file was copied
+    @staticmethod
+    def copy(source, destination):
+        if os.path.normcase(source) == os.path.normcase(destination):
+            return False
+        if os.path.exists(destination):
+            source_stat = os.stat(source)
+            destination_stat = os.stat(destination)
+            if source_stat.st_size == destination_stat.st_size:
+                if int(source_stat.st_mtime) == int(destination_stat.st_mtime):
+                    return False
+                if TextureDeployment.get_hash(source) == TextureDeployment.get_hash(destination):
+                    # same content: the modification time makes the next check cheap
+                    shutil.copystat(source, destination)
+                    return False
+        shutil.copy2(source, destination)
+        return True
+
+    @staticmethod
+    def get_hash(filename, chunk_size=2 ** 20):
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.digest()
+
+    # waits for the copies and reports them
+    def finish(self):
+        copied = 0
+        failed = 0
+        for source, destination, future in self.copies.values():
+            try:
+                copied += future.result()
+            except Exception:
+                print("Copying texture %s to %s failed." % (source, destination))
+                failed += 1
+        self.executor.shutdown(wait=True)
+        if self.copies:
+            print("Textures: %i copied, %i up to date" % (copied, len(self.copies) - copied - failed))
+        self.copies = {}
+
+
+# Memory held by the exporter for the frames (snapshots, captured samples, frames being encoded and frames held by the
+# frame reduction), tallied from the sizes of the arrays against a limit. Frames are only captured, and the frame
+# reduction only holds frames, within what is left of the limit: the files are written in place, so besides the
+# snapshots and the frames in flight (always needed) the memory does not grow with the number of frames
+class MemoryBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def fits(self, size):
+        return self.in_use + size <= self.limit
+
+    def get_available(self):
+        return max(0, self.limit - self.in_use)
+
+    # the encoder threads release memory too
+    def acquire(self, size):
+        with self.lock:
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, size):
+        with self.lock:
+            self.in_use -= size
 
 
 # noinspection PyBroadException
@@ -265,160 +1018,449 @@ class MD2:
         self.options = options
         self.objects = objects
         self.scale = scale
-        self.bbox_min = None
-        self.bbox_max = None
+        self.vertex_order = None
+        # vertices of every object in the snapshot, every sampled frame has to match them
+        self.vertex_counts = None
+        # copies of the textures, while the model is written
+        self.textures = None
+        # ArmatureSkin or ShapeKeyAnimation of every object, None if the object is evaluated by Blender
+        self.samplers = [None] * len(objects)
+        # the samplers whose deformation is disabled in the scene while the frames are sampled, None until the first
+        # frame change
+        self.suspended = None
         return
 
-    def pre_compute_bbox(self, header):
-        # Since position are computed (integers value between 0-255 then multiplied by scale stored in frame)
-        # In cas of animated object with fixed point, fixed point will move a bit each frame. By using the same
-        # bbox it fixes the problem and give more smooth items
-        bbox_min = None
-        bbox_max = None
+    def write(self, filename):
+        # the textures are copied while the geometry is encoded
+        self.textures = TextureDeployment()
+        try:
+            self.write_model(filename)
+        finally:
+            self.resume_deformations()
+            self.textures.finish()
 
-        for frame in range(1, header.num_frames + 1):
-            bpy.context.scene.frame_set(frame)
+    def write_model(self, filename):
+        # the topology (triangles, texture coordinates) is taken from the evaluated meshes at the current frame
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        try:
+            meshes = [Util.get_evaluated_mesh(obj, depsgraph) for obj in self.objects]
+            snapshot = MeshSnapshot(meshes)
+        finally:
             for obj in self.objects:
-                mesh = obj.to_mesh(preserve_all_data_layers=True)
-                mesh.transform(obj.matrix_world)
-                mesh.transform(mathutils.Matrix.Rotation(-pi / 2, 4, 'Z'))
-                (bbox_min, bbox_max) = Util.compute_bounding_box(mesh, bbox_min, bbox_max)
+                Util.release_evaluated_mesh(obj, depsgraph)
 
-        self.bbox_min = bbox_min
-        self.bbox_max = bbox_max
+        self.vertex_counts = snapshot.mesh_vertex_counts
+        if self.options.fFastArmatureSkinning or self.options.fFastShapeKeys:
+            self.create_samplers(depsgraph, snapshot)
 
-    def write(self, filename):
-        meshes = [obj.data for obj in self.objects]
-        print(meshes)
         skins = Util.get_skins(self.objects)
-
-        num_frames = 1
-        if self.options.fExportAnimation:
-            num_frames = 1 + bpy.context.scene.frame_end - bpy.context.scene.frame_start
-
-        header = MD2Header(skins, meshes, num_frames)
-
-        file = open(filename, 'wb')
+        skin_names = bytearray(64 * len(skins))
+        self.write_skins(memoryview(skin_names), filename, skins)
+
+        # meshes over the index limits of MD2 are exported into several files
+        parts = [snapshot]
+        if self.options.fPartition:
+            partition = Util.partition_triangles(snapshot, self.options.fMergeTextureCoordinates)
+            if len(partition) > 1:
+                parts = [snapshot.get_part(triangles) for triangles in partition]
+                print("Mesh split into %i parts" % len(parts))
+
+        # the sections which do not depend on the frames are encoded once, for all files of a part
+        statics = []
+        for part in parts:
+            if self.options.fOptimizeVertexCache:
+                (acmr_before, acmr_after) = part.optimize_vertex_cache()
+                print("Vertex cache: ACMR %.3f before, %.3f after reordering" % (acmr_before, acmr_after))
+
+            gl_commands = MD2GLCommands(part)
+            print("GL commands: %i strips and %i fans, %.2f triangles on average" % (
+                gl_commands.num_strips, gl_commands.num_fans, gl_commands.average_length))
+
+            texture_coordinates = MD2TextureCoordinates(part, self.options.fMergeTextureCoordinates)
+            print("Texture coordinates: %i of %i entries used" % (
+                texture_coordinates.num_st, len(texture_coordinates.indices)))
+
+            statics.append(MD2StaticSections(skins, skin_names, part, texture_coordinates, gl_commands))
+
+        frames = self.get_frames()
+
+        # memory held by the exporter: snapshots, captured frames and the frames being encoded
+        memory = MemoryBudget(self.options.iMemoryLimit * 2 ** 20)
+        snapshots_size = sum(part.get_size() for part in parts) + (snapshot.get_size() if len(parts) > 1 else 0)
+        memory.acquire(snapshots_size)
+        sample_size = snapshot.num_vertices * (3 * 4 + 1)  # float32 positions and the normal indices
+        # the parts are encoded from a capture of all vertices, one part after the other
+        capture_size = len(frames) * sample_size
+        if len(parts) > 1:
+            capture_size += len(frames) * max(part.num_vertices for part in parts) * (3 * 4 + 1)
+
+        # the frames are sampled in the vertex order of the snapshot. The parts share one capture of all vertices
+        # (in the order of the evaluated meshes) if it fits
+        self.vertex_order = parts[0].vertex_order if len(parts) == 1 else None
+
+        # the main thread only evaluates the frames, the normal lookup and the encoding of the frames run on the
+        # encoder threads meanwhile. Every sample is (co, future of the normal indices)
+        with FrameEncoder() as encoder:
+            # normals waiting for their lookup, and the capture of the frames (released once all files are written)
+            captures_size = encoder.queue_size * snapshot.num_vertices * 3 * 4
+            memory.acquire(captures_size)
+
+            samples = None
+            if (self.options.fExportAnimation and self.options.iWorkerProcesses > 1 and len(frames) > 1 and
+                    memory.fits(capture_size) and self.can_shard()):
+                # the frames are evaluated by several Blender instances at once and returned as a capture
+                samples = self.sample_frames_sharded(frames, min(self.options.iWorkerProcesses, len(frames)))
+            elif len(parts) > 1 and memory.fits(capture_size):
+                samples = list(self.sample_frames(frames, encoder))
+            if samples is not None:
+                memory.acquire(len(samples) * sample_size)
+                captures_size += len(samples) * sample_size
+
+            # the parts are encoded one after the other while the encoder threads still encode and write the
+            # previous ones
+            files = []
+            for index, static in enumerate(statics):
+                part_filename = filename
+                part_samples = samples
+                part_capture_size = 0
+                if len(parts) > 1:
+                    part_filename = Util.get_part_filename(filename, index)
+                    self.vertex_order = static.snapshot.vertex_order
+                    if samples is not None:
+                        part_samples = [(co[self.vertex_order], FrameEncoder.get_done_future(
+                            normal_indices.result()[self.vertex_order])) for co, normal_indices in samples]
+                        part_capture_size = len(part_samples) * static.snapshot.num_vertices * (3 * 4 + 1)
+                        memory.acquire(part_capture_size)
+
+                written = []
+                for clip_filename, clip_frames, clip_samples in self.get_clips(part_filename, frames, part_samples):
+                    written.append(self.write_animation(clip_filename, clip_frames, static, encoder, memory,
+                                                        clip_samples))
+                    files.append((index, clip_filename))
+                # the capture of the part is referenced by the encoder jobs until its files are written
+                encoder.submit(MD2.release_after, written, memory, part_capture_size)
+                part_samples = None
+            encoder.join()
+            memory.release(captures_size)
+        memory.release(snapshots_size)
+
+        if len(parts) > 1:
+            self.write_manifest(filename, parts, files)
+
+        print("Peak of the frame data: %.1f MB (limit %i MB)" % (memory.peak / 2 ** 20, self.options.iMemoryLimit))
+
+    # returns (filename, frames, samples) of every file of the animation: one file per clip if the clips are split
+    def get_clips(self, filename, frames, samples=None):
+        if not (self.options.fExportAnimation and self.options.fSplitClips):
+            return [(filename, frames, samples)]
+
+        clips = []
+        clip_names = [marker.name for marker in self.get_markers()] or ['frame']
+        clip_filenames = set()
+        for clip in sorted({frame[1] for frame in frames}):
+            indices = [i for i, frame in enumerate(frames) if frame[1] == clip]
+            # markers with the same (cleaned) name would overwrite each other: the index of the clip is appended
+            name = clip_names[clip]
+            collisions = 0
+            while os.path.normcase(Util.get_clip_filename(filename, name)) in clip_filenames:
+                collisions += 1
+                name = "%s_%i" % (clip_names[clip], clip) + ("_%i" % collisions if collisions > 1 else '')
+            clip_filename = Util.get_clip_filename(filename, name)
+            if collisions:
+                print("Clip %s exported to %s, its file name is used by another marker" % (clip_names[clip],
+                                                                                          clip_filename))
+            clip_filenames.add(os.path.normcase(clip_filename))
+            clips.append((clip_filename, [frames[i] for i in indices],
+                          None if samples is None else [samples[i] for i in indices]))
+        return clips
+
+    # writes the manifest of a partitioned export: the files, vertices, triangles and objects of every part
+    def write_manifest(self, filename, parts, files):
+        manifest = {'parts': []}
+        for index, part in enumerate(parts):
+            manifest['parts'].append({
+                'files': [os.path.basename(part_filename) for part_index, part_filename in files
+                          if part_index == index],
+                'vertices': int(part.num_vertices),
+                'triangles': int(part.num_triangles),
+                'objects': [self.objects[obj].name for obj in np.unique(part.triangle_objects)],
+            })
+
+        manifest_filename = os.path.splitext(filename)[0] + '.json'
+        with open(manifest_filename, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        print("Exported %i parts, described in %s" % (len(parts), manifest_filename))
+
+    # Samples (unless samples, a capture of the frames, are given) and encodes the frames into an MD2 file. The encoder
+    # jobs write the frame blocks into the file as soon as they are encoded, the last job writes the header and the
+    # static sections. Returns the future of the last job
+    def write_animation(self, filename, frames, static, encoder, memory, samples=None):
+        decimate = self.options.fExportAnimation and self.options.rFrameTolerance > 0
+        sample_size = static.snapshot.num_vertices * (3 * 4 + 1)  # float32 positions and the normal indices
+        frame_block_size = 40 + 4 * static.snapshot.num_vertices
+        # the frames being encoded, memory released once the file is written (a given capture is released by the
+        # caller)
+        held = encoder.queue_size * (sample_size + frame_block_size)
+        memory.acquire(held)
+
+        bbox = (None, None)
+        if samples is not None:
+            if self.options.useSameBoundingBox or decimate:
+                bbox = Util.compute_bounding_box([co for co, _ in samples])
+        elif self.options.fExportAnimation and (self.options.useSameBoundingBox or decimate):
+            # Since position are computed (integers value between 0-255 then multiplied by scale stored in frame)
+            # In cas of animated object with fixed point, fixed point will move a bit each frame. By using the
+            # same bbox it fixes the problem and give more smooth items.
+            if memory.fits(len(frames) * sample_size):
+                # Every frame is evaluated only once: the sampled vertices are kept, reduced to the common
+                # bounding box and the frames are encoded from this capture.
+                samples = []
+                for sample in self.sample_frames(frames, encoder):
+                    memory.acquire(sample_size)
+                    samples.append(sample)
+                held += len(samples) * sample_size
+                bbox = Util.compute_bounding_box([co for co, _ in samples])
+            else:
+                # the capture would exceed the memory limit: a first pass only reduces the bounding box, the
+                # frames are evaluated again while they are encoded
+                print("Frame capture exceeds the memory limit, the animation is sampled twice")
+                for co, _ in self.sample_frames(frames, encoder, normals=False):
+                    bbox = Util.merge_bounding_boxes(bbox, Util.compute_bounding_box([co]))
+
+        # without the same bounding box, every frame is quantized in its own
+        frame_bbox = bbox if self.options.useSameBoundingBox else (None, None)
+
+        # the frame blocks start after the static sections whatever the number of frames: with frame reduction the
+        # kept frames are written as soon as they are known, the header only once all frames are sampled
+        layout = static.create_header(len(frames))
+        md2_file = MD2File(filename)
+        jobs = []
         try:
-            header.write(file)
-
-            self.write_skins(file, filename, skins)
-            for mesh in meshes:
-                self.write_texture_coordinates(file, header, mesh)
-            self.write_triangles(file, meshes)
-
-            if self.options.fExportAnimation:
-                time_line_markers = []
-                for marker in bpy.context.scene.timeline_markers:
-                    time_line_markers.append(marker)
-
-                # sort the markers. The marker with the frame number closest to 0 will be the first marker in the list.
-                # The marker with the biggest frame number will be the last marker in the list
-                time_line_markers.sort(key=lambda marker: marker.frame)
-                marker_idx = 0
-
-                # delete markers at same frame positions
-                if len(time_line_markers) > 1:
-                    marker_frame = time_line_markers[len(time_line_markers) - 1].frame
-                    for i in range(len(time_line_markers) - 2, -1, -1):
-                        if time_line_markers[i].frame == marker_frame:
-                            del time_line_markers[i]
-                        else:
-                            marker_frame = time_line_markers[i].frame
-
-                # BL: to fix: 1 is assumed to be the frame start (this is
-                # hardcoded sometimes...)
-
-                if self.options.useSameBoundingBox:
-                    self.pre_compute_bbox(header)
-
-                for frame in range(1, header.num_frames + 1):
-                    bpy.context.scene.frame_set(frame)
-
-                    if len(time_line_markers) != 0:
-                        if marker_idx + 1 != len(time_line_markers):
-                            if frame >= time_line_markers[marker_idx + 1].frame:
-                                marker_idx += 1
-                        name = time_line_markers[marker_idx].name
-                    else:
-                        name = 'frame'
-
-                    self.write_frame(file, name + str(frame))
+            if decimate:
+                window = max(2, memory.get_available() // max(sample_size, 1))
+                decimator = FrameDecimator(bbox[0], bbox[1], self.options.rFrameTolerance, window)
+                pending = 0
+                for frame, sample in zip(frames, self.sample_frames(frames, encoder, samples)):
+                    kept = decimator.add(frame, *sample)
+                    if samples is None:
+                        # frames dropped by the decimator are only held while they are pending
+                        memory.acquire(sample_size)
+                        memory.release((pending + 1 - decimator.get_num_held()) * sample_size)
+                        pending = decimator.get_num_held()
+                    for kept_frame, co, normal_indices in kept:
+                        jobs.append(encoder.submit(self.write_sample, md2_file, layout, len(jobs), co, normal_indices,
+                                                   kept_frame[2], frame_bbox))
+                for kept_frame, co, normal_indices in decimator.finish():
+                    jobs.append(encoder.submit(self.write_sample, md2_file, layout, len(jobs), co, normal_indices,
+                                               kept_frame[2], frame_bbox))
+                memory.release(pending * sample_size)
+                print("Frame reduction: %i of %i frames kept" % (len(jobs), len(frames)))
             else:
-                self.write_frame(file)
+                for i, (frame, (co, normal_indices)) in enumerate(zip(frames, self.sample_frames(frames, encoder,
+                                                                                                samples))):
+                    jobs.append(encoder.submit(self.write_sample, md2_file, layout, i, co, normal_indices, frame[2],
+                                               frame_bbox))
+        except BaseException:
+            md2_file.discard()
+            raise
+
+        header = static.create_header(len(jobs))
+        return encoder.submit(self.write_file, md2_file, static, header, jobs, memory, held)
+
+    # encoder job: waits for the frame blocks, writes the header and the static sections and closes the file
+    @staticmethod
+    def write_file(md2_file, static, header, jobs, memory, held):
+        try:
+            for job in jobs:
+                job.result()
+            static.write(md2_file, header)
+            md2_file.close()
+        except BaseException:
+            md2_file.discard()
+            raise
+        memory.release(held)
+        print("Exported %i frames to %s" % (header.num_frames, md2_file.filename))
+
+    # encoder job: releases memory once the given jobs are done
+    @staticmethod
+    def release_after(jobs, memory, size):
+        for job in jobs:
+            job.result()
+        memory.release(size)
+
+    # creates the samplers of the objects which support them (armature deformation or shape keys), checked against
+    # the evaluated meshes of the snapshot (before its vertices are reordered): an object whose sampled positions do
+    # not match is evaluated by Blender
+    def create_samplers(self, depsgraph, snapshot):
+        offset = 0
+        for i, (obj, count) in enumerate(zip(self.objects, snapshot.mesh_vertex_counts)):
+            expected = snapshot.positions[offset:offset + count]
+            offset += count
+            if count == 0:
+                continue
 
-            for mesh in meshes:
-                self.write_gl_commands(file, mesh)
-        finally:
-            file.close()
+            sampler = None
+            if obj.data.shape_keys is not None:
+                if self.options.fFastShapeKeys:
+                    sampler = ShapeKeyAnimation.create(obj)
+            elif self.options.fFastArmatureSkinning:
+                sampler = ArmatureSkin.create(obj)
+            if sampler is None:
+                continue
 
-    @staticmethod
-    def write_gl_commands(file, mesh):
-        for tri in mesh.loop_triangles:  # for face in mesh.faces:
-            uvs = []
-            for loop_index in tri.loops:
-                try:
-                    uv = mesh.uv_layers[0].data[loop_index].uv
-                except:
-                    uv = [0, 0]
-                uvs.append(uv)
-
-            pack = struct.pack('<i', 3)
-            file.write(pack)
-            # 0,2,1 for good cw/ccw (also flips/inverts normal)
-            for vert in [0, 2, 1]:
-                # (u,v) in blender -> (u,1-v)
-                pack = struct.pack('<ffI',
-                                   uvs[vert][0],
-                                   (1.0 - uvs[vert][1]),
-                                   tri.vertices[vert])
-
-                file.write(pack)
-        # NULL command
-        pack = struct.pack('<I', 0)
-        file.write(pack)
+            (co, _) = sampler.sample(depsgraph, None, normals=False)
+            extent = max(float(np.ptp(expected, axis=0).max()), 1e-6)
+            if len(co) != count or np.abs(co - expected).max() > 1e-3 * extent:
+                print("Deformation of %s evaluated by Blender: the sampled positions do not match" % obj.name)
+                continue
+            self.samplers[i] = sampler
+        print("Deformation evaluated with NumPy for %i of %i objects" % (
+            len(self.samplers) - self.samplers.count(None), len(self.objects)))
+
+    # changes the frame of the scene, unless all objects are sampled without evaluating the scene
+    def set_frame(self, frame):
+        if any(sampler is None or sampler.needs_scene() for sampler in self.samplers):
+            # the scene only evaluates what the samplers don't compute themselves
+            self.suspend_deformations()
+            bpy.context.scene.frame_set(frame)
 
+    # disables the deformations computed by the samplers in the scene, until resume_deformations
+    def suspend_deformations(self):
+        if self.suspended is None:
+            self.suspended = [sampler for sampler in self.samplers if sampler is not None and sampler.suspend()]
+
+    def resume_deformations(self):
+        for sampler in self.suspended or []:
+            sampler.resume()
+        self.suspended = None
+
+    # yields (co, future of the normal indices) of the given frames: from the captured samples if there are some,
+    # otherwise every frame is evaluated and the lookup of its normals is queued on the encoder. Only the arrays of
+    # the yielded frame are kept by this generator
+    def sample_frames(self, frames, encoder, samples=None, normals=True):
+        if samples is not None:
+            for i in range(len(frames)):
+                yield samples[i]
+            return
+
+        for frame, clip, name in frames:
+            if frame is not None:
+                self.set_frame(frame)
+            (co, frame_normals) = self.sample_frame(normals, frame)
+            yield co, encoder.submit(Util.find_closest_normals, frame_normals) if normals else None
+
+    # the workers start in the middle of the timeline: simulations with an unbaked cache, which are only valid when the
+    # frames are evaluated one after the other, are sampled in this instance
+    def can_shard(self):
+        for obj in Util.get_dependencies(self.objects):
+            cache = Util.get_unbaked_cache(obj, bpy.context.scene)
+            if cache is not None:
+                print("Frames sampled in this instance: the %s of %s is not baked" % (cache, obj.name))
+                return False
+        return True
+
+    # evaluates the frames in background Blender instances: each of the num_workers processes opens a copy of the
+    # .blend file, samples a contiguous range of the frames in the vertex order of the snapshot and stores the vertex
+    # positions and normal indices as .npy files. Returns the samples in frame order, like sample_frames
+    def sample_frames_sharded(self, frames, num_workers):
+        samples = []
+        with tempfile.TemporaryDirectory(prefix='md2_export_') as directory:
+            blend_path = os.path.join(directory, 'scene.blend')
+            bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+            vertex_order_path = None
+            if self.vertex_order is not None:
+                vertex_order_path = os.path.join(directory, 'vertex_order.npy')
+                np.save(vertex_order_path, self.vertex_order)
+
+            processes = []
+            try:
+                for i, indices in enumerate(np.array_split(np.arange(len(frames)), num_workers)):
+                    job = {
+                        'objects': [obj.name for obj in self.objects],
+                        'samplers': [type(sampler).__name__ if sampler else None for sampler in self.samplers],
+                        'frames': [frames[index][0] for index in indices],
+                        'vertex_counts': self.vertex_counts,
+                        'vertex_order': vertex_order_path,
+                        'co': os.path.join(directory, 'co_%i.npy' % i),
+                        'normals': os.path.join(directory, 'normals_%i.npy' % i),
+                    }
+                    job_path = os.path.join(directory, 'job_%i.json' % i)
+                    with open(job_path, 'w') as file:
+                        json.dump(job, file)
+                    process = subprocess.Popen([bpy.app.binary_path, '--background', '-noaudio', blend_path,
+                                                '--python-exit-code', '1', '--python', os.path.abspath(__file__),
+                                                '--', '--md2-worker', job_path])
+                    processes.append((job, process))
+
+                for job, process in processes:
+                    if process.wait() != 0:
+                        raise RuntimeError("MD2 export worker for the frames %i-%i failed (exit code %i)" % (
+                            job['frames'][0], job['frames'][-1], process.returncode))
+            finally:
+                for job, process in processes:
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+
+            for job, process in processes:
+                co = np.load(job['co'])
+                normal_indices = np.load(job['normals'])
+                samples.extend((co[i], FrameEncoder.get_done_future(normal_indices[i])) for i in range(len(co)))
+        print("Frames sampled by %i worker processes" % len(processes))
+        return samples
+
+    # returns the timeline markers sorted by frame, a single marker per frame
     @staticmethod
-    def write_triangles(file, meshes):
-        vertices_index = 0
-        faces_index = 0
-        for mesh in meshes:
-            for face in mesh.loop_triangles:
-                # 0,2,1 for good cw/ccw
-                pack = struct.pack('<3H',
-                                   vertices_index + face.vertices[0],
-                                   vertices_index + face.vertices[2],
-                                   vertices_index + face.vertices[1]
-                                   )
-                file.write(pack)  # vert index
-                pack = struct.pack('<3H',
-                                   (faces_index + face.index) * 3 + 0,
-                                   (faces_index + face.index) * 3 + 2,
-                                   (faces_index + face.index) * 3 + 1,
-                                   )
-
-                file.write(pack)  # uv index
-            vertices_index += len(mesh.vertices)
-            faces_index += len(mesh.loop_triangles)
+    def get_markers():
+        time_line_markers = []
+        for marker in bpy.context.scene.timeline_markers:
+            time_line_markers.append(marker)
+
+        # sort the markers. The marker with the frame number closest to 0 will be the first marker in the list.
+        # The marker with the biggest frame number will be the last marker in the list
+        time_line_markers.sort(key=lambda marker: marker.frame)
+
+        # delete markers at same frame positions
+        if len(time_line_markers) > 1:
+            marker_frame = time_line_markers[len(time_line_markers) - 1].frame
+            for i in range(len(time_line_markers) - 2, -1, -1):
+                if time_line_markers[i].frame == marker_frame:
+                    del time_line_markers[i]
+                else:
+                    marker_frame = time_line_markers[i].frame
+        return time_line_markers
+
+    # returns (frame, clip, name) of every exported frame, clip is the index of the timeline marker the frame belongs
+    # to. Without animation, there is only the current frame (frame is None)
+    def get_frames(self):
+        if not self.options.fExportAnimation:
+            return [(None, 0, 'frame')]
+
+        time_line_markers = self.get_markers()
+        marker_idx = 0
+
+        frames = []
+        for frame in range(self.options.iFrameStart, self.options.iFrameEnd + 1, self.options.iFrameStep):
+            if len(time_line_markers) != 0:
+                while marker_idx + 1 != len(time_line_markers) and frame >= time_line_markers[marker_idx + 1].frame:
+                    marker_idx += 1
+                name = time_line_markers[marker_idx].name
+            else:
+                name = 'frame'
+
+            frames.append((frame, marker_idx, name + str(frame)))
+        return frames
 
     @staticmethod
-    def write_texture_coordinates(file, header, mesh):
-        for tri in mesh.loop_triangles:  # for face in mesh.faces:
-            for loop_index in tri.loops:
-                try:
-                    uv = mesh.uv_layers[0].data[loop_index].uv
-                except:
-                    uv = [0, 0]
-
-                # (u,v) in blender -> (u,1-v)
-                pack = struct.pack('<2h',
-                                   int(uv[0] * header.skin_width),
-                                   int((1 - uv[1]) * header.skin_height),
-                                   )
-                file.write(pack)  # uv
-            # (uv index is : face.index*3+i)
-
-    def write_skins(self, file, filename, skins):
+    def write_triangles(buffer, snapshot, st_indices):
+        triangles = np.empty(snapshot.num_triangles, dtype=MD2_TRIANGLE_DTYPE)
+        # 0,2,1 for good cw/ccw
+        triangles['vertices'] = Util.check_range(snapshot.triangle_vertices[:, [0, 2, 1]], 'H')  # vert index
+        triangles['st'] = Util.check_range(st_indices.reshape(-1, 3)[:, [0, 2, 1]], 'H')  # uv index
+        buffer[:] = triangles.tobytes()
+
+    def write_skins(self, buffer, filename, skins):
+        names = np.zeros(len(skins), dtype=MD2_SKIN_DTYPE)
         # write skin file names
         for iSkin, skin in enumerate(skins):
 
@@ -431,11 +1473,7 @@ class MD2:
                     # rename first skin to basename
                     fn_sx_s = os.path.splitext(filename)[0] + os.path.splitext(image_filename)[1]
 
-                print("Copying texture %s to %s" % (image_filename, fn_sx_s))
-                try:
-                    shutil.copy(image_filename, fn_sx_s)
-                except:
-                    print("Copying texture %s to %s failed." % (image_filename, fn_sx_s))
+                self.textures.deploy(image_filename, fn_sx_s)
 
                 image_filename = fn_sx_s  # for proper referencing in the MD2 file
 
@@ -446,25 +1484,68 @@ class MD2:
             if len(image_filename) > 63 or self.options.fExportOnlyTextureBasename:
                 image_filename = os.path.basename(image_filename)
 
-            pack = struct.pack('<64s', bytes(image_filename[0:63], encoding='utf8'))
-            file.write(pack)  # skin name
-
-    def write_frame(self, file, frameName='frame'):
-        meshes = []
-        for obj in self.objects:
-            mesh = obj.to_mesh(preserve_all_data_layers=True)
-            mesh.transform(obj.matrix_world)
-            mesh.transform(mathutils.Matrix.Rotation(-pi / 2, 4, 'Z'))
-            meshes.append(mesh)
-        # mesh.transform(mathutils.Matrix.Rotation(pi / 2, 4, 'X'))
-        # mesh.transform(mathutils.Matrix.Rotation(pi, 4, 'Z'))
-
-        bbox_min = self.bbox_min
-        bbox_max = self.bbox_max
+            names[iSkin] = bytes(image_filename[0:63], encoding='utf8')  # skin name
+
+        buffer[:] = names.tobytes()
+
+    # encodes a sampled frame and writes its frame block into the file
+    def write_frame(self, file, header, index, co, normal_indices, frameName='frame', bbox=(None, None)):
+        file.write(header.get_frame_offset(index), self.encode_frame(co, normal_indices, frameName, bbox))
+
+    # encoder job: encodes a sampled frame and writes it at its offset once the lookup of its normal indices is done
+    def write_sample(self, file, header, index, co, normal_indices, frameName, bbox):
+        self.write_frame(file, header, index, co, normal_indices.result(), frameName, bbox)
+
+    # evaluates the objects at the given frame (the current frame of the scene if None or if the scene is evaluated),
+    # returns the vertex positions and normals (None if normals is False). The temporary meshes are released right
+    # after their arrays are read
+    def sample_frame(self, normals=True, frame=None):
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        rotation = mathutils.Matrix.Rotation(-pi / 2, 4, 'Z')
+        co = []
+        vertex_normals = []
+        for i, (obj, sampler) in enumerate(zip(self.objects, self.samplers)):
+            if sampler is not None:
+                (mesh_co, mesh_normals) = sampler.sample(depsgraph, frame, rotation, normals)
+            else:
+                obj_eval = obj.evaluated_get(depsgraph)
+                mesh = obj_eval.to_mesh()
+                try:
+                    # world space, then rotated for the MD2 coordinate system, in one transform
+                    mesh.transform(rotation @ obj_eval.matrix_world)
+                    # mesh.transform(mathutils.Matrix.Rotation(pi / 2, 4, 'X'))
+                    # mesh.transform(mathutils.Matrix.Rotation(pi, 4, 'Z'))
+
+                    # read all vertex positions and normals at once
+                    (mesh_co, mesh_normals) = Util.get_vertex_arrays([mesh])
+                finally:
+                    obj_eval.to_mesh_clear()
+
+            # the triangles of the snapshot index the vertices of every frame: modifiers which change the vertices
+            # over time (decimate, remesh, boolean, build...) can't be exported
+            if self.vertex_counts is not None and len(mesh_co) != self.vertex_counts[i]:
+                raise RuntimeError("%s has %i vertices at frame %i instead of %i: the vertex count of an exported "
+                                   "object must not change during the animation" % (
+                                       obj.name, len(mesh_co), bpy.context.scene.frame_current if frame is None
+                                       else frame, self.vertex_counts[i]))
+            co.append(mesh_co)
+            vertex_normals.append(mesh_normals)
+
+        co = np.concatenate(co)
+        vertex_normals = np.concatenate(vertex_normals) if normals else None
+        if self.vertex_order is not None:
+            co = co[self.vertex_order]
+            if normals:
+                vertex_normals = vertex_normals[self.vertex_order]
+        return co, vertex_normals
+
+    # returns the frame header and the quantized vertices of a sampled frame, quantized in the given bounding box
+    # (the bounding box of the frame if None)
+    def encode_frame(self, co, normal_indices, frameName='frame', bbox=(None, None)):
+        (bbox_min, bbox_max) = bbox
 
         if bbox_min is None:
-            for mesh in meshes:
-                (bbox_min, bbox_max) = Util.compute_bounding_box(mesh, bbox_min, bbox_max)
+            (bbox_min, bbox_max) = Util.compute_bounding_box([co])
 
         [min_x, min_y, min_z] = bbox_min
         [max_x, max_y, max_z] = bbox_max
@@ -492,119 +1573,115 @@ class MD2:
                            # and finally the name.
                            bytes(frameName, encoding='utf8'))
 
-        file.write(pack)  # frame header
-
-        # Vertices
-
-        for mesh in meshes:
-            for vert in mesh.vertices:
-                best_normal_index = Util.find_closest_normal(vert.normal)
-                # and now write the normal.
-                pack = struct.pack('<4B',
-                                   int((vert.co[0] - min_x) * isdx),
-                                   int((vert.co[1] - min_y) * isdy),
-                                   int((vert.co[2] - min_z) * isdz),
-                                   best_normal_index)
-
-                file.write(pack)  # write vertex and normal
+        # frame header followed by the vertices
+        return pack + Util.encode_vertices(co, normal_indices, bbox_min, (isdx, isdy, isdz))
 
 
 class Util:
+    # returns a temporary mesh of the evaluated object (all modifiers including the armature applied) with its
+    # loop triangles computed. It has to be freed with release_evaluated_mesh
     @staticmethod
-    def pick_name(base_name):
-        name = '_MD2Obj_' + base_name + '_' + str(random.random())
-        return name[0:20]
+    def get_evaluated_mesh(obj, depsgraph):
+        mesh = obj.evaluated_get(depsgraph).to_mesh()
+        mesh.calc_loop_triangles()
+        return mesh
 
-    # deletes an object from Blender (remove + unlink)
     @staticmethod
-    def delete_object(obj):
-        bpy.context.collection.objects.unlink(obj)
-        bpy.data.objects.remove(obj)
+    def release_evaluated_mesh(obj, depsgraph):
+        obj.evaluated_get(depsgraph).to_mesh_clear()
 
+    # returns (vertices, triangles) of the evaluated object without building a triangulated copy: an n-gon is
+    # always split into n - 2 triangles
     @staticmethod
-    def backup_selection():
-        # backup the current object selection and current active object
-        selected_objects = bpy.context.selected_objects[:]
-        active_object = bpy.context.active_object
-        return active_object, selected_objects
-
+    def count_triangles(obj, depsgraph):
+        mesh = obj.evaluated_get(depsgraph).data
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', loop_totals)
+        return len(mesh.vertices), int(loop_totals.sum()) - 2 * len(loop_totals)
+
+    # returns the distinct texture coordinates of the evaluated object as keys of MD2TextureCoordinates, every loop is
+    # the corner of a triangle
     @staticmethod
-    def restore_selection(active_object, selected_objects):
-        bpy.context.view_layer.objects.active = active_object
-        for obj in selected_objects:
-            obj.select_set(state=True)
-
-    # duplicates the given object and returns it
+    def get_texture_coordinate_keys(obj, depsgraph):
+        mesh = obj.evaluated_get(depsgraph).data
+        uvs = np.zeros(len(mesh.loops) * 2, dtype=np.float32)
+        if len(mesh.uv_layers) != 0:
+            mesh.uv_layers[0].data.foreach_get('uv', uvs)
+        return np.unique(MD2TextureCoordinates.get_keys(MD2TextureCoordinates.get_st(uvs.reshape(-1, 2))))
+
+    # returns the objects the given objects depend on: their parents and the objects referenced by their modifiers and
+    # constraints, recursively. The given objects are included
     @staticmethod
-    def duplicate_object(obj, name):
-        active_object, selected_objects = Util.backup_selection()
-
-        # deselect all selected objects
-        bpy.ops.object.select_all(action='DESELECT')
-        # select the object which we want to duplicate
-        obj.select_set(state=True)
-
-        # duplicate the selected object
-        bpy.ops.object.duplicate()
-
-        # the duplicated object is automatically selected
-        copy_obj = bpy.context.selected_objects[0]
-
-        # rename the object with the given name
-        copy_obj.name = name
-
-        # select all objects which have been previously selected and make active the previous active object
-        Util.restore_selection(active_object, selected_objects)
-
-        return copy_obj
-
+    def get_dependencies(objects):
+        dependencies = []
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            if obj in dependencies:
+                continue
+            dependencies.append(obj)
+            if obj.parent is not None:
+                stack.append(obj.parent)
+            stack.extend(Util.get_referenced_objects(obj))
+        return dependencies
+
+    # returns the objects which use the deformed mesh of the object: through their modifiers and constraints, parented
+    # to its vertices or instanced on it
     @staticmethod
-    def duplicate_and_apply_modifiers(obj, new_name):
-        for o in bpy.context.scene.objects:
-            if not o.hide_viewport:
-                o.select_set(state=False)
-        # select the object which we want to apply modifiers to
-        obj.select_set(state=True)
-
-        # duplicate the selected object
-        bpy.ops.object.duplicate()
-
-        # the duplicated object is automatically selected
-        duplicate_object = bpy.context.selected_objects[0]
-
-        # now apply all modifiers except the Armature modifier...
-        for modifier in duplicate_object.modifiers:
-            if modifier.type == "ARMATURE":
-                # these must stay for the animation
+    def get_dependents(obj, objects):
+        dependents = []
+        for other in objects:
+            if other == obj:
                 continue
+            if other.parent == obj and (other.parent_type in ('VERTEX', 'VERTEX_3') or obj.instance_type != 'NONE'):
+                dependents.append(other)
+            elif obj in Util.get_referenced_objects(other):
+                dependents.append(other)
+        return dependents
 
-            # all others can be applied.
-            bpy.ops.object.modifier_apply(modifier=modifier.name)
-
-        duplicate_object.name = new_name
-
-        return duplicate_object
-
-    # returns the mesh of the object and return object.data (mesh)
+    # returns the objects referenced by the modifiers and constraints of the object
     @staticmethod
-    def triangulate_mesh(obj):
-        mesh = obj.data
-
-        obj.select_set(state=True)
-        # make the object the active object!
-        bpy.context.view_layer.objects.active = obj
-
-        bpy.ops.object.mode_set(mode="EDIT", toggle=False)
-        bpy.ops.mesh.select_all(action="SELECT")
-
-        bpy.ops.mesh.quads_convert_to_tris()
-        bpy.ops.object.mode_set(mode="OBJECT", toggle=False)
-
-        # FIXME
-        mesh.calc_loop_triangles()
-
-        print(mesh)
-        return mesh
+    def get_referenced_objects(obj):
+        referenced = []
+        for item in list(obj.modifiers) + list(obj.constraints):
+            for prop in item.bl_rna.properties:
+                if prop.type == 'POINTER':
+                    value = getattr(item, prop.identifier)
+                    if isinstance(value, bpy.types.Object):
+                        referenced.append(value)
+            # the targets of the armature constraint
+            for target in getattr(item, 'targets', ()):
+                if target.target is not None:
+                    referenced.append(target.target)
+        return referenced
+
+    # returns a description of the first simulation cache of the object which is not baked, None if there is none.
+    # Fluid simulations are not checked, they count as not baked
+    @staticmethod
+    def get_unbaked_cache(obj, scene):
+        caches = []
+        for modifier in obj.modifiers:
+            if modifier.type in ('CLOTH', 'SOFT_BODY'):
+                caches.append(("%s simulation %s" % (modifier.type.lower().replace('_', ' '), modifier.name),
+                               modifier.point_cache))
+            elif modifier.type == 'DYNAMIC_PAINT' and modifier.canvas_settings is not None:
+                caches.extend(("dynamic paint surface %s" % surface.name, surface.point_cache)
+                              for surface in modifier.canvas_settings.canvas_surfaces)
+            elif modifier.type == 'FLUID':
+                return "fluid simulation %s" % modifier.name
+        for particle_system in obj.particle_systems:
+            # hair without dynamics is not simulated
+            if particle_system.settings.type != 'HAIR' or particle_system.use_hair_dynamics:
+                caches.append(("particle system %s" % particle_system.name, particle_system.point_cache))
+        world = scene.rigidbody_world
+        if world is not None and world.enabled and (obj.rigid_body is not None or
+                                                    obj.rigid_body_constraint is not None):
+            caches.append(("rigid body world", world.point_cache))
+
+        for name, cache in caches:
+            if not cache.is_baked:
+                return name
+        return None
 
     @staticmethod
     def get_skins(objects):
@@ -619,18 +1696,252 @@ class Util:
 
         return skins
 
+    # returns the polygons of the mesh as loops: (vertex, polygon of every loop, first loop of every polygon, next and
+    # previous loop in the polygon of every loop), see compute_vertex_normals
+    @staticmethod
+    def get_polygon_loops(mesh):
+        loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertices)
+        loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('loop_start', loop_starts)
+        mesh.polygons.foreach_get('loop_total', loop_totals)
+        loop_polygons = np.repeat(np.arange(len(loop_totals)), loop_totals)
+        corners = np.arange(len(loop_vertices)) - loop_starts[loop_polygons]
+        totals = loop_totals[loop_polygons]
+        next_loops = loop_starts[loop_polygons] + (corners + 1) % totals
+        prev_loops = loop_starts[loop_polygons] + (corners - 1) % totals
+        return loop_vertices, loop_polygons, loop_starts, next_loops, prev_loops
+
+    # Vertex normals of a mesh like Blender computes them: the normals of the polygons (Newell) are accumulated
+    # weighted by the angle of the polygon corner at the vertex. Vertices without normal get their normalized position
+    @staticmethod
+    def compute_vertex_normals(co, loop_vertices, loop_polygons, loop_starts, next_loops, prev_loops):
+        def normalize(vectors):
+            lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+            return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
+
+        corners = co[loop_vertices]
+        next_corners = co[loop_vertices[next_loops]]
+        # relative to the first corner of the polygon for precision
+        origins = co[loop_vertices[loop_starts]][loop_polygons]
+        polygon_normals = np.cross(corners - origins, next_corners - origins)
+        polygon_normals = normalize(np.add.reduceat(polygon_normals, loop_starts) if len(loop_starts) else
+                                    np.zeros((0, 3)))
+
+        cosines = np.einsum('ij,ij->i', normalize(next_corners - corners), normalize(co[loop_vertices[prev_loops]] -
+                                                                                    corners))
+        contributions = polygon_normals[loop_polygons] * np.arccos(np.clip(cosines, -1.0, 1.0))[:, None]
+        normals = np.stack([np.bincount(loop_vertices, weights=contributions[:, i], minlength=len(co))
+                            for i in range(3)], axis=1)
+
+        lengths = np.linalg.norm(normals, axis=1)
+        normals[lengths == 0] = co[lengths == 0]
+        return normalize(normals)
+
+    # Splits the triangles of the snapshot into parts within the index limits of MD2: at most MD2_MAX_VERTICES vertices
+    # and MD2_MAX_TEXTURE_COORDINATES texture coordinates (3 per triangle, or the distinct ones if they are merged).
+    # Whole objects are put together (in order) while they fit into a part, an object too big for a part is cut into
+    # spatially coherent clusters. Returns the triangle indices of every part
+    @staticmethod
+    def partition_triangles(snapshot, merge=False):
+        centers = snapshot.positions[snapshot.triangle_vertices].mean(axis=1)
+        keys = None
+        if merge:
+            keys = MD2TextureCoordinates.get_keys(MD2TextureCoordinates.get_st(
+                snapshot.triangle_uvs.reshape(-1, 2))).reshape(-1, 3)
+
+        # (vertices, texture coordinates) of the given triangles, the distinct texture coordinates if merged
+        def count_indices(triangles):
+            num_vertices = len(np.unique(snapshot.triangle_vertices[triangles]))
+            return num_vertices, len(np.unique(keys[triangles])) if merge else 3 * len(triangles)
+
+        parts = []
+        part = []
+        for obj in range(len(snapshot.mesh_vertex_counts)):
+            triangles = np.flatnonzero(snapshot.triangle_objects == obj)
+            if len(triangles) == 0:
+                continue
+            if part and not Util.fits_indices(*count_indices(np.concatenate(part + [triangles]))):
+                parts.append(np.concatenate(part))
+                part = []
+            if Util.fits_indices(*count_indices(triangles)):
+                part.append(triangles)
+            else:
+                parts.extend(Util.split_triangles(centers, triangles, count_indices))
+        if part:
+            parts.append(np.concatenate(part))
+        # the triangles keep their order in every part
+        return [np.sort(triangles) for triangles in parts]
+
+    # whether vertex and texture coordinate indices fit the triangles of an MD2 file
+    @staticmethod
+    def fits_indices(num_vertices, num_st):
+        return num_vertices <= MD2_MAX_VERTICES and num_st <= MD2_MAX_TEXTURE_COORDINATES
+
+    # cuts the triangles in two along the longest axis of their centers until every cluster is within the index limits
+    # (counted by count_indices), the clusters are about the same size
+    @staticmethod
+    def split_triangles(centers, triangles, count_indices):
+        (num_vertices, num_st) = count_indices(triangles)
+        num_clusters = max(-(-num_vertices // MD2_MAX_VERTICES), -(-num_st // MD2_MAX_TEXTURE_COORDINATES))
+        if num_clusters <= 1:
+            return [triangles]
+        size = len(triangles) * (num_clusters // 2) // num_clusters
+        points = centers[triangles]
+        order = np.argsort(points[:, np.argmax(np.ptp(points, axis=0))], kind='stable')
+        return (Util.split_triangles(centers, triangles[order[:size]], count_indices) +
+                Util.split_triangles(centers, triangles[order[size:]], count_indices))
+
+    # returns the file name of a part: its index appended to the file name
+    @staticmethod
+    def get_part_filename(filename, index):
+        (root, ext) = os.path.splitext(filename)
+        return "%s_part%i%s" % (root, index, ext)
+
+    # returns the file name of a clip: the name of the marker appended to the file name
+    @staticmethod
+    def get_clip_filename(filename, clip_name):
+        (root, ext) = os.path.splitext(filename)
+        return "%s_%s%s" % (root, bpy.path.clean_name(clip_name), ext)
+
+    # returns the bounding box (as lists) over all given (n, 3) vertex position arrays
     @staticmethod
-    def compute_bounding_box(mesh, bbox_min, bbox_max):
-        bbox_min = bbox_min or [mesh.vertices[0].co[0], mesh.vertices[0].co[1], mesh.vertices[0].co[2]]
-        bbox_max = bbox_max or [mesh.vertices[0].co[0], mesh.vertices[0].co[1], mesh.vertices[0].co[2]]
+    def compute_bounding_box(co_arrays):
+        bbox_min = np.min([co.min(axis=0) for co in co_arrays], axis=0)
+        bbox_max = np.max([co.max(axis=0) for co in co_arrays], axis=0)
+        return bbox_min.tolist(), bbox_max.tolist()
 
-        for vert in mesh.vertices:
-            for i in range(3):
-                if vert.co[i] < bbox_min[i]:
-                    bbox_min[i] = vert.co[i]
-                if vert.co[i] > bbox_max[i]:
-                    bbox_max[i] = vert.co[i]
-        return bbox_min, bbox_max
+    # returns the bounding box containing both given bounding boxes, (None, None) is an empty bounding box
+    @staticmethod
+    def merge_bounding_boxes(bbox, other):
+        if bbox[0] is None:
+            return other
+        return ([min(a, b) for a, b in zip(bbox[0], other[0])],
+                [max(a, b) for a, b in zip(bbox[1], other[1])])
+
+    # reads the vertex positions and normals of all meshes into two (n, 3) arrays
+    @staticmethod
+    def get_vertex_arrays(meshes):
+        count = sum(len(mesh.vertices) for mesh in meshes)
+        co = np.empty(count * 3, dtype=np.float32)
+        normals = np.empty(count * 3, dtype=np.float32)
+        offset = 0
+        for mesh in meshes:
+            size = len(mesh.vertices) * 3
+            mesh.vertices.foreach_get('co', co[offset:offset + size])
+            mesh.vertices.foreach_get('normal', normals[offset:offset + size])
+            offset += size
+        return co.reshape(-1, 3), normals.reshape(-1, 3)
+
+    # Tom Forsyth's "Linear-Speed Vertex Cache Optimisation": greedily emits the triangle with the best score, the
+    # score of a vertex grows with its position in the simulated cache and with few remaining triangles.
+    # Returns the new order of the triangles
+    @staticmethod
+    def optimize_triangle_order(triangles, num_vertices, cache_size=VERTEX_CACHE_SIZE):
+        vertex_triangles = [[] for _ in range(num_vertices)]
+        for i, tri in enumerate(triangles):
+            for vertex in tri:
+                vertex_triangles[vertex].append(i)
+        cache_positions = [-1] * num_vertices
+
+        def vertex_score(vertex):
+            remaining = len(vertex_triangles[vertex])
+            if remaining == 0:
+                return -1.0
+            position = cache_positions[vertex]
+            if position < 0:
+                score = 0.0
+            elif position < 3:
+                # the vertices of the last triangle
+                score = 0.75
+            else:
+                score = (1.0 - (position - 3) / (cache_size - 3)) ** 1.5
+            # bonus for vertices with few remaining triangles
+            return score + 2.0 * remaining ** -0.5
+
+        vertex_scores = [vertex_score(vertex) for vertex in range(num_vertices)]
+        triangle_scores = [sum(vertex_scores[vertex] for vertex in tri) for tri in triangles]
+        added = [False] * len(triangles)
+        order = []
+        cache = []
+        next_unadded = 0
+
+        best = max(range(len(triangles)), key=triangle_scores.__getitem__) if triangles else None
+        while best is not None:
+            added[best] = True
+            order.append(best)
+
+            for vertex in triangles[best]:
+                vertex_triangles[vertex].remove(best)
+                if vertex in cache:
+                    cache.remove(vertex)
+                cache.insert(0, vertex)
+            evicted = cache[cache_size:]
+            del cache[cache_size:]
+            for vertex in evicted:
+                cache_positions[vertex] = -1
+            for position, vertex in enumerate(cache):
+                cache_positions[vertex] = position
+
+            # update the scores around the cache, the best next triangle is one of those
+            for vertex in cache + evicted:
+                vertex_scores[vertex] = vertex_score(vertex)
+            best = None
+            best_score = -1.0
+            for vertex in cache:
+                for i in vertex_triangles[vertex]:
+                    score = triangle_scores[i] = sum(vertex_scores[v] for v in triangles[i])
+                    if score > best_score:
+                        best = i
+                        best_score = score
+            for vertex in evicted:
+                for i in vertex_triangles[vertex]:
+                    triangle_scores[i] = sum(vertex_scores[v] for v in triangles[i])
+
+            if best is None:
+                # nothing left around the cache: continue with the next unused triangle
+                while next_unadded < len(triangles) and added[next_unadded]:
+                    next_unadded += 1
+                if next_unadded < len(triangles):
+                    best = next_unadded
+        return order
+
+    # average cache miss ratio: transformed vertices per triangle with a LRU cache of the given size
+    @staticmethod
+    def compute_acmr(triangles, cache_size=VERTEX_CACHE_SIZE):
+        if not triangles:
+            return 0.0
+        cache = []
+        misses = 0
+        for tri in triangles:
+            for vertex in tri:
+                if vertex in cache:
+                    cache.remove(vertex)
+                else:
+                    misses += 1
+                cache.insert(0, vertex)
+            del cache[cache_size:]
+        return misses / len(triangles)
+
+    # raises the error struct.pack would raise if the values do not fit into the given struct format character
+    @staticmethod
+    def check_range(values, fmt):
+        info = np.iinfo(np.dtype(fmt))
+        if values.size and (values.min() < info.min or values.max() > info.max):
+            raise struct.error("'%s' format requires %i <= number <= %i" % (fmt, info.min, info.max))
+        return values
+
+    # quantizes the vertices against the bounding box and returns the '<4B' vertex block of a frame
+    @staticmethod
+    def encode_vertices(co, normal_indices, bbox_min, inverse_scale):
+        # same arithmetic as int((co - min) * isd) in double precision, int() truncates towards zero
+        quantized = Util.check_range(((co.astype(np.float64) - bbox_min) * inverse_scale).astype(np.int64), 'B')
+
+        vertices = np.empty((len(co), 4), dtype=np.uint8)
+        vertices[:, 0:3] = quantized
+        vertices[:, 3] = normal_indices
+        return vertices.tobytes()
 
     @staticmethod
     def find_closest_normal(normal):
@@ -648,6 +1959,20 @@ class Util:
                 best_normal_index = i
         return best_normal_index
 
+    # batched version of find_closest_normal: returns the same index for every row of normals
+    @staticmethod
+    def find_closest_normals(normals, chunk_size=4096):
+        normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+        indices = np.empty(len(normals), dtype=np.uint8)
+        # the (chunk, 162) dot product matrix is evaluated in slices to bound the memory use
+        for start in range(0, len(normals), chunk_size):
+            chunk = normals[start:start + chunk_size]
+            # same swizzle and evaluation order as find_closest_normal, so the dot products are
+            # bit-identical and argmax picks the same (first) maximum
+            dots = chunk[:, 1:2] * MD2_NORMALS_X + -chunk[:, 0:1] * MD2_NORMALS_Y + chunk[:, 2:3] * MD2_NORMALS_Z
+            indices[start:start + chunk_size] = dots.argmax(axis=1)
+        return indices
+
     @staticmethod
     def get_visible_mesh_objects():
         objects = []
@@ -658,8 +1983,16 @@ class Util:
 
 
 class ObjectInfo:
-    def __init__(self, obj):
+    # (vertices, triangles, distinct texture coordinates) of the evaluated objects by address (names are reused after a
+    # rename), the texture coordinates are None until they are asked for. Entries are dropped by depsgraph updates and
+    # everything when a file is loaded
+    counts_cache = {}
+
+    def __init__(self, obj, depsgraph=None, texture_coordinates=False):
         self.vertices = -1
+        self.triangles_count = 0
+        # keys of MD2TextureCoordinates, only if texture_coordinates is True
+        self.texture_coordinates = None
         self.status = ('', '')
 
         self.is_mesh = obj and obj.type == 'MESH'
@@ -667,23 +2000,54 @@ class ObjectInfo:
         if self.is_mesh:
             self.skins = Util.get_skins([obj])
 
-            tmp_object_name = Util.pick_name(obj.name)
-            duplicated_object = None
-            try:
-                # apply the modifiers
-                duplicated_object = Util.duplicate_and_apply_modifiers(obj, tmp_object_name)
-                mesh = Util.triangulate_mesh(duplicated_object)
+            counts = ObjectInfo.counts_cache.get(obj.as_pointer())
+            if counts is None or (texture_coordinates and counts[2] is None):
+                depsgraph = depsgraph or bpy.context.evaluated_depsgraph_get()
+                if counts is None:
+                    counts = Util.count_triangles(obj, depsgraph) + (None,)
+                if texture_coordinates:
+                    counts = counts[:2] + (Util.get_texture_coordinate_keys(obj, depsgraph),)
+                ObjectInfo.counts_cache[obj.as_pointer()] = counts
+            (self.vertices, self.triangles_count, self.texture_coordinates) = counts
 
-                self.status = (str(len(mesh.vertices)) + ' vertices', str(len(mesh.loop_triangles)) + ' faces')
-                self.triangles_count = len(mesh.loop_triangles)
-                self.vertices = len(mesh.vertices)
-
-            finally:
-                if duplicated_object is not None:
-                    Util.delete_object(duplicated_object)
+            self.status = (str(self.vertices) + ' vertices', str(self.triangles_count) + ' faces')
 
         print(self.status)
 
+    # returns why an export of the objects exceeds the index limits of MD2, None if it fits. The texture coordinates of
+    # the infos are needed if they are merged
+    @staticmethod
+    def get_limit_error(infos, merge):
+        num_vertices = sum(max(info.vertices, 0) for info in infos)
+        if num_vertices > MD2_MAX_VERTICES:
+            return "Object has too many vertices (%i), at most %i are supported in md2" % (num_vertices,
+                                                                                          MD2_MAX_VERTICES)
+        if merge:
+            keys = [info.texture_coordinates for info in infos if info.texture_coordinates is not None]
+            num_st = len(np.unique(np.concatenate(keys))) if keys else 0
+            if num_st > MD2_MAX_TEXTURE_COORDINATES:
+                return "Object has too many distinct texture coordinates (%i), at most %i are supported in md2" % (
+                    num_st, MD2_MAX_TEXTURE_COORDINATES)
+        else:
+            # every triangle has its own three texture coordinates
+            num_triangles = sum(info.triangles_count for info in infos)
+            if 3 * num_triangles > MD2_MAX_TEXTURE_COORDINATES:
+                return ("Object has too many (triangulated) faces (%i), at most %i are supported in md2 without merged "
+                        "texture coordinates" % (num_triangles, MD2_MAX_TEXTURE_COORDINATES // 3))
+        return None
+
+    @staticmethod
+    def invalidate(depsgraph):
+        for update in depsgraph.updates:
+            if not update.is_updated_geometry:
+                continue
+            if isinstance(update.id, bpy.types.Object):
+                ObjectInfo.counts_cache.pop(update.id.original.as_pointer(), None)
+            else:
+                # mesh data (possibly shared by several objects) changed
+                ObjectInfo.counts_cache.clear()
+                return
+
 
 class OBJECT_OT_Export_MD2(bpy.types.Operator, ExportHelper):
     """Export to Quake2 file format (.md2)"""
@@ -708,6 +2072,62 @@ class OBJECT_OT_Export_MD2(bpy.types.Operator, ExportHelper):
                                                description="default: True",
                                                default=True)
 
+    fMergeTextureCoordinates: bpy.props.BoolProperty(name="Merge identical texture coordinates",
+                                                     description="default: False",
+                                                     default=False)
+
+    iFrameStart: bpy.props.IntProperty(name="Start frame for animation",
+                                       description="default: scene start frame",
+                                       default=1)
+
+    iFrameEnd: bpy.props.IntProperty(name="End frame for animation",
+                                     description="default: scene end frame",
+                                     default=250)
+
+    iFrameStep: bpy.props.IntProperty(name="Stepsize for animation",
+                                      description="default: scene frame step",
+                                      default=1, min=1)
+
+    rFrameTolerance: bpy.props.FloatProperty(name="Frame reduction tolerance",
+                                             description="Drop frames which the interpolation of their neighbours "
+                                                         "reproduces within this many quantization steps (0: keep all)",
+                                             default=0.0, min=0.0)
+
+    fSplitClips: bpy.props.BoolProperty(name="One file per timeline marker",
+                                        description="Export the frames of every marker into their own file, "
+                                                    "named after the marker (default: False)",
+                                        default=False)
+
+    fPartition: bpy.props.BoolProperty(name="Split into parts over the MD2 limits",
+                                       description="Export meshes with more than %i vertices or texture "
+                                                   "coordinates into several files described by a .json manifest "
+                                                   "(default: False)" % MD2_MAX_VERTICES,
+                                       default=False)
+
+    fOptimizeVertexCache: bpy.props.BoolProperty(name="Optimize triangle order for the vertex cache",
+                                                 description="default: False",
+                                                 default=False)
+
+    fFastArmatureSkinning: bpy.props.BoolProperty(name="Fast armature deformation",
+                                                  description="Skin meshes deformed by an armature only with NumPy "
+                                                              "instead of evaluating them (default: True)",
+                                                  default=True)
+
+    fFastShapeKeys: bpy.props.BoolProperty(name="Fast shape key animation",
+                                           description="Evaluate the shape keys of meshes without modifiers from "
+                                                       "their fcurves with NumPy (default: True)",
+                                           default=True)
+
+    iWorkerProcesses: bpy.props.IntProperty(name="Worker processes for animation",
+                                            description="Evaluate the frames in this many background Blender "
+                                                        "instances (1: in this instance only)",
+                                            default=1, min=1)
+
+    iMemoryLimit: bpy.props.IntProperty(name="Memory limit [MB]",
+                                        description="Animations whose frames do not fit are sampled twice instead "
+                                                    "of being kept in memory",
+                                        default=1024, min=16)
+
     fExportOnlyTextureBasename: bpy.props.BoolProperty(name="Export only basenames (skin)",
                                                        description="default: True",
                                                        default=True)
@@ -734,25 +2154,32 @@ class OBJECT_OT_Export_MD2(bpy.types.Operator, ExportHelper):
         filepath = self.filepath
         filepath = bpy.path.ensure_ext(filepath, self.filename_ext)
 
-        active_object, selected_objects = Util.backup_selection()
+        # scripted exports skip invoke: the frame range not given explicitly is the one of the scene
+        for name, value in (('iFrameStart', context.scene.frame_start), ('iFrameEnd', context.scene.frame_end),
+                            ('iFrameStep', context.scene.frame_step)):
+            if not self.properties.is_property_set(name):
+                setattr(self, name, value)
+
+        if self.fExportAnimation and self.iFrameStart > self.iFrameEnd:
+            self.report({'ERROR'}, "The start frame (%i) is after the end frame (%i)" % (self.iFrameStart, self.iFrameEnd))
+            return {'CANCELLED'}
+
+        infos = [ObjectInfo(obj, texture_coordinates=self.fMergeTextureCoordinates) for obj in self.objects]
+        error = ObjectInfo.get_limit_error(infos, self.fMergeTextureCoordinates)
+        if error is not None and not self.fPartition:
+            self.report({'ERROR'}, error)
+            return {'CANCELLED'}
+
         # save the current frame to reset it after export
         frame = None
         if self.fExportAnimation:
             frame = bpy.context.scene.frame_current
 
-        duplicate_objects = []
         try:
-            for obj in self.objects:
-                obj = Util.duplicate_and_apply_modifiers(obj, Util.pick_name(obj.name))
-                Util.triangulate_mesh(obj)
-                duplicate_objects.append(obj)
-
-            md2 = MD2(self, duplicate_objects, self.rScaleFactor)
+            # the objects are exported through their evaluated meshes: no duplicates, no operators
+            md2 = MD2(self, self.objects, self.rScaleFactor)
             md2.write(filepath)
         finally:
-            Util.restore_selection(active_object, selected_objects)
-            for obj in duplicate_objects:
-                Util.delete_object(obj)
             if self.fExportAnimation:
                 bpy.context.scene.frame_set(frame)
 
@@ -760,30 +2187,64 @@ class OBJECT_OT_Export_MD2(bpy.types.Operator, ExportHelper):
         return {'FINISHED'}
 
     def invoke(self, context, event):
-        active_object, selected_objects = Util.backup_selection()
-        try:
-            total_triangles_count = 0
-            for obj in self.objects:
-                info = ObjectInfo(obj)
-                total_triangles_count += info.triangles_count
-
-            if total_triangles_count * 3 > 2 ** 16:
-                self.report({'ERROR'},
-                            "Object has too many (triangulated) faces (%i), at most %i vertices are supported in md2" % (
-                                total_triangles_count, (2 ** 16) / 3))
-                return {'CANCELLED'}
-
-            wm = context.window_manager
-            wm.fileselect_add(self)
-            return {'RUNNING_MODAL'}
-        finally:
-            Util.restore_selection(active_object, selected_objects)
+        # set the animation range depending on the current scene
+        self.iFrameStart = context.scene.frame_start
+        self.iFrameEnd = context.scene.frame_end
+        self.iFrameStep = context.scene.frame_step
+
+        depsgraph = context.evaluated_depsgraph_get()
+        infos = [ObjectInfo(obj, depsgraph, self.fMergeTextureCoordinates) for obj in self.objects]
+        error = ObjectInfo.get_limit_error(infos, self.fMergeTextureCoordinates)
+        if error is not None:
+            self.report({'WARNING'}, error + ": the export is split into parts")
+            self.fPartition = True
+
+        wm = context.window_manager
+        wm.fileselect_add(self)
+        return {'RUNNING_MODAL'}
 
 
 def menu_cb(self, context):
     self.layout.operator(OBJECT_OT_Export_MD2.bl_idname, text="MD2 (.md2)")
 
 
+# worker process of the sharded export (see MD2.sample_frames_sharded), runs in a background Blender instance
+def run_worker(job_path):
+    with open(job_path) as file:
+        job = json.load(file)
+
+    md2 = MD2(None, [bpy.data.objects[name] for name in job['objects']])
+    md2.samplers = [SAMPLER_TYPES[name].create(obj) if name else None
+                    for obj, name in zip(md2.objects, job['samplers'])]
+    if job['vertex_order'] is not None:
+        md2.vertex_order = np.load(job['vertex_order'])
+    md2.vertex_counts = job['vertex_counts']
+
+    co = []
+    normal_indices = []
+    try:
+        for frame in job['frames']:
+            md2.set_frame(frame)
+            (frame_co, frame_normals) = md2.sample_frame(frame=frame)
+            co.append(frame_co)
+            normal_indices.append(Util.find_closest_normals(frame_normals))
+    finally:
+        md2.resume_deformations()
+    np.save(job['co'], np.stack(co))
+    np.save(job['normals'], np.stack(normal_indices))
+
+
+@bpy.app.handlers.persistent
+def depsgraph_update_cb(scene, depsgraph):
+    ObjectInfo.invalidate(depsgraph)
+
+
+# the objects of another file may get the addresses of the previous ones
+@bpy.app.handlers.persistent
+def load_post_cb(dummy):
+    ObjectInfo.counts_cache.clear()
+
+
 classes = (
     OBJECT_OT_Export_MD2,
 )
@@ -794,6 +2255,8 @@ def register():
     for cls in classes:
         register_class(cls)
     bpy.types.TOPBAR_MT_file_export.append(menu_cb)
+    bpy.app.handlers.depsgraph_update_post.append(depsgraph_update_cb)
+    bpy.app.handlers.load_post.append(load_post_cb)
 
 
 def unregister():
@@ -801,7 +2264,15 @@ def unregister():
     for cls in reversed(classes):
         unregister_class(cls)
     bpy.types.TOPBAR_MT_file_export.remove(menu_cb)
+    bpy.app.handlers.depsgraph_update_post.remove(depsgraph_update_cb)
+    bpy.app.handlers.load_post.remove(load_post_cb)
+    ObjectInfo.counts_cache.clear()
 
 
 if __name__ == "__main__":
-    register()
+    # blender --background file.blend --python md2_export_282.py -- --md2-worker job.json
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    if '--md2-worker' in argv:
+        run_worker(argv[argv.index('--md2-worker') + 1])
+    else:
+        register()
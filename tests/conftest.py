@@ -0,0 +1,40 @@
+# The exporters import bpy, bpy_extras and mathutils, which only exist inside Blender. Outside of Blender minimal
+# stand-ins are installed, enough to import the modules and run the parts which do not touch the scene.
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def install_blender_stubs():
+    try:
+        import bpy  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    bpy = types.ModuleType('bpy')
+    bpy.types = types.SimpleNamespace(Operator=type('Operator', (), {}), Object=type('Object', (), {}))
+    bpy.props = types.ModuleType('bpy.props')
+    for name in ('BoolProperty', 'EnumProperty', 'FloatProperty', 'IntProperty', 'StringProperty'):
+        setattr(bpy.props, name, lambda **kwargs: None)
+    bpy.app = types.SimpleNamespace(handlers=types.SimpleNamespace(persistent=lambda function: function,
+                                                                   depsgraph_update_post=[]))
+    bpy.path = types.SimpleNamespace(abspath=lambda path: path, clean_name=lambda name: name)
+    # the VRML exporter reads the frame range of the scene for the defaults of its properties
+    bpy.context = types.SimpleNamespace(scene=types.SimpleNamespace(
+        frame_start=1, frame_end=250, frame_step=1, render=types.SimpleNamespace(fps=24)))
+    sys.modules['bpy'] = bpy
+    sys.modules['bpy.props'] = bpy.props
+
+    bpy_extras = types.ModuleType('bpy_extras')
+    bpy_extras.io_utils = types.ModuleType('bpy_extras.io_utils')
+    bpy_extras.io_utils.ExportHelper = type('ExportHelper', (), {})
+    sys.modules['bpy_extras'] = bpy_extras
+    sys.modules['bpy_extras.io_utils'] = bpy_extras.io_utils
+
+    sys.modules['mathutils'] = types.ModuleType('mathutils')
+
+
+install_blender_stubs()
@@ -0,0 +1,75 @@
+# The frame reduction drops frames which the linear interpolation of the kept frames reproduces within the tolerance.
+# These tests decimate synthetic animations and check the error of every dropped frame against the kept neighbours.
+import numpy as np
+import pytest
+
+from md2_export_282 import FrameDecimator, Util
+
+
+# (frame, clip, name) and the vertex positions of an animation: a still clip, a linear move, a swing and noise
+def create_animation(seed):
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=(40, 3))
+    frames = []
+    co = []
+    for i in range(120):
+        if i < 30:
+            offset = np.zeros(3)
+        elif i < 60:
+            offset = np.array([(i - 30) * 0.1, 0.0, 0.0])
+        elif i < 90:
+            offset = np.array([3.0, np.sin((i - 60) * 0.3), 0.0])
+        else:
+            offset = rng.normal(size=3) * 0.05
+        frames.append((i + 1, i // 30, 'frame%i' % (i + 1)))
+        co.append((base + offset).astype(np.float32))
+    return frames, co
+
+
+def decimate(frames, co, tolerance, window):
+    bbox = Util.compute_bounding_box(co)
+    decimator = FrameDecimator(bbox[0], bbox[1], tolerance, window)
+    kept = []
+    for frame, frame_co in zip(frames, co):
+        kept.extend(kept_frame for kept_frame, _, _ in decimator.add(frame, frame_co, None))
+    kept.extend(kept_frame for kept_frame, _, _ in decimator.finish())
+    return bbox, kept
+
+
+@pytest.mark.parametrize('tolerance', [0.25, 1.0, 4.0])
+@pytest.mark.parametrize('window', [None, 2, 5])
+def test_dropped_frames_within_tolerance(tolerance, window):
+    (frames, co) = create_animation(seed=int(tolerance * 4))
+    (bbox, kept) = decimate(frames, co, tolerance, window)
+
+    steps = 255.0 / (np.array(bbox[1]) - np.array(bbox[0]))
+    kept_indices = [frames.index(frame) for frame in kept]
+    assert kept_indices == sorted(kept_indices)
+    for start, end in zip(kept_indices, kept_indices[1:]):
+        for dropped in range(start + 1, end):
+            t = (frames[dropped][0] - frames[start][0]) / (frames[end][0] - frames[start][0])
+            interpolated = co[start].astype(np.float64) + (co[end].astype(np.float64) - co[start]) * t
+            assert np.abs((interpolated - co[dropped]) * steps).max() <= tolerance
+        if window is not None:
+            assert end - start - 1 < window
+
+
+def test_clip_boundaries_kept():
+    (frames, co) = create_animation(seed=1)
+    (_, kept) = decimate(frames, co, 1000.0, None)
+
+    clips = sorted({clip for _, clip, _ in frames})
+    for clip in clips:
+        clip_frames = [frame for frame in frames if frame[1] == clip]
+        assert clip_frames[0] in kept
+        assert clip_frames[-1] in kept
+    assert len(kept) == 2 * len(clips)
+
+
+def test_still_animation_keeps_first_and_last_frame():
+    frames = [(i, 0, 'frame%i' % i) for i in range(1, 11)]
+    co = [np.arange(12, dtype=np.float32).reshape(4, 3)] * len(frames)
+
+    (_, kept) = decimate(frames, co, 0.5, None)
+
+    assert kept == [frames[0], frames[-1]]
@@ -0,0 +1,72 @@
+# The frame vertices are quantized with NumPy. These tests keep the original per-vertex struct.pack('<4B') loop as the
+# reference and compare the encoded frames byte for byte.
+import struct
+
+import numpy as np
+import pytest
+
+from md2_export_282 import MD2, Util
+
+
+# random vertex positions and unit normals, as float32 like the arrays read from Blender
+def create_frame(count, seed, offset=0.0):
+    rng = np.random.default_rng(seed)
+    co = (rng.normal(size=(count, 3)) * [3.0, 1.0, 0.01] + offset).astype(np.float32)
+    normals = rng.normal(size=(count, 3))
+    normals = (normals / np.linalg.norm(normals, axis=1, keepdims=True)).astype(np.float32)
+    return co, normals
+
+
+# the frame writer before the vectorization: Python floats and one pack per vertex
+def reference_frame(co, normals, frame_name, bbox, scale):
+    (bbox_min, bbox_max) = bbox
+    if bbox_min is None:
+        (bbox_min, bbox_max) = Util.compute_bounding_box([co])
+    [min_x, min_y, min_z] = bbox_min
+    [max_x, max_y, max_z] = bbox_max
+    sdx = (max_x - min_x) / 255.0
+    sdy = (max_y - min_y) / 255.0
+    sdz = (max_z - min_z) / 255.0
+    isdx = 255.0 / (max_x - min_x)
+    isdy = 255.0 / (max_y - min_y)
+    isdz = 255.0 / (max_z - min_z)
+
+    data = struct.pack('<6f16s', scale * sdx, scale * sdy, scale * sdz, scale * min_x, scale * min_y,
+                       scale * min_z, bytes(frame_name, encoding='utf8'))
+    for vertex_co, normal in zip(co.tolist(), normals.tolist()):
+        data += struct.pack('<4B',
+                            int((vertex_co[0] - min_x) * isdx),
+                            int((vertex_co[1] - min_y) * isdy),
+                            int((vertex_co[2] - min_z) * isdz),
+                            Util.find_closest_normal(normal))
+    return data
+
+
+@pytest.mark.parametrize('count', [2, 7, 5000])
+def test_encode_frame_matches_reference(count):
+    (co, normals) = create_frame(count, seed=count)
+    md2 = MD2(None, [], scale=10.0)
+
+    encoded = md2.encode_frame(co, Util.find_closest_normals(normals), 'idle12')
+
+    assert encoded == reference_frame(co, normals, 'idle12', (None, None), 10.0)
+
+
+def test_encode_frame_in_shared_bounding_box():
+    frames = [create_frame(500, seed=seed, offset=seed) for seed in range(4)]
+    bbox = Util.compute_bounding_box([co for co, _ in frames])
+    md2 = MD2(None, [], scale=0.5)
+
+    for co, normals in frames:
+        encoded = md2.encode_frame(co, Util.find_closest_normals(normals), 'run', bbox)
+        assert encoded == reference_frame(co, normals, 'run', bbox, 0.5)
+
+
+def test_encode_vertices_out_of_range():
+    (co, normals) = create_frame(10, seed=3)
+    (bbox_min, bbox_max) = Util.compute_bounding_box([co[:-1]])
+    inverse_scale = [255.0 / (high - low) for low, high in zip(bbox_min, bbox_max)]
+    co[-1] = np.array(bbox_max, dtype=np.float32) + 1.0
+
+    with pytest.raises(struct.error):
+        Util.encode_vertices(co, Util.find_closest_normals(normals), bbox_min, inverse_scale)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from md2_export_282 import MD2_NORMALS, Util
+
+
+# evenly spread unit vectors (Fibonacci lattice), as float32 like the normals read from Blender
+def sample_sphere(count):
+    i = np.arange(count) + 0.5
+    z = 1.0 - 2.0 * i / count
+    radius = np.sqrt(1.0 - z * z)
+    angle = np.pi * (3.0 - np.sqrt(5.0)) * i
+    return np.stack([radius * np.cos(angle), radius * np.sin(angle), z], axis=1).astype(np.float32)
+
+
+def test_find_closest_normals_matches_find_closest_normal():
+    normals = np.concatenate([sample_sphere(20000),
+                              np.zeros((1, 3), dtype=np.float32),
+                              np.array(MD2_NORMALS, dtype=np.float32),
+                              -np.array(MD2_NORMALS, dtype=np.float32)])
+
+    expected = [Util.find_closest_normal(normal) for normal in normals.tolist()]
+
+    assert Util.find_closest_normals(normals).tolist() == expected
+
+
+def test_find_closest_normals_chunks():
+    normals = sample_sphere(1000)
+
+    assert np.array_equal(Util.find_closest_normals(normals, chunk_size=7), Util.find_closest_normals(normals))
+
+
+def test_find_closest_normals_empty():
+    assert len(Util.find_closest_normals(np.empty((0, 3), dtype=np.float32))) == 0
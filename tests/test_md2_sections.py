@@ -0,0 +1,154 @@
+# The static MD2 sections are encoded through NumPy structured dtypes. These tests keep the original struct.pack
+# encoders as the reference and compare the bytes on synthetic multi-mesh input.
+import os
+import struct
+import types
+
+import numpy as np
+import pytest
+
+from md2_export_282 import MD2, MD2GLCommands, MD2Header, MD2TextureCoordinates, MeshSnapshot
+
+
+class Collection(list):
+    def foreach_get(self, name, buffer):
+        buffer[:] = np.array([getattr(item, name) for item in self], dtype=buffer.dtype).reshape(-1)
+
+
+# a triangulated (width x height) grid with a UV seam in the middle of every row, or without UV layer
+def create_mesh(width, height, offset=(0.0, 0.0, 0.0), uvs=True, seed=0):
+    rng = np.random.default_rng(seed)
+    vertices = Collection()
+    for y in range(height + 1):
+        for x in range(width + 1):
+            co = (x + offset[0], y + offset[1], rng.random() + offset[2])
+            vertices.append(types.SimpleNamespace(co=co, normal=(0.0, 0.0, 1.0)))
+
+    triangles = Collection()
+    loop_uvs = Collection()
+    for y in range(height):
+        for x in range(width):
+            a = y * (width + 1) + x
+            for corners in ((a, a + 1, a + width + 2), (a, a + width + 2, a + width + 1)):
+                loops = []
+                for vertex in corners:
+                    loops.append(len(loop_uvs))
+                    u = (vertex % (width + 1)) / width
+                    if x >= width // 2 and vertex % (width + 1) == width // 2:
+                        u += 0.25
+                    loop_uvs.append(types.SimpleNamespace(uv=(u, (vertex // (width + 1)) / height)))
+                triangles.append(types.SimpleNamespace(vertices=corners, loops=loops))
+
+    uv_layers = [types.SimpleNamespace(data=loop_uvs)] if uvs else []
+    return types.SimpleNamespace(vertices=vertices, loop_triangles=triangles, loops=loop_uvs, uv_layers=uv_layers)
+
+
+def create_snapshot(uvs):
+    return MeshSnapshot([create_mesh(6, 4, seed=1),
+                         create_mesh(3, 5, offset=(10.0, 0.0, 0.0), uvs=uvs, seed=2),
+                         create_mesh(1, 1, offset=(0.0, 10.0, 0.0), seed=3)])
+
+
+def reference_header(header):
+    return struct.pack('<4B16i', ord('I'), ord('D'), ord('P'), ord('2'), header.version, header.skin_width,
+                       header.skin_height, header.frame_size, header.num_skins, header.num_xyz, header.num_st,
+                       header.num_tris, header.num_gl_commands, header.num_frames, header.ofs_skins, header.ofs_st,
+                       header.ofs_tris, header.ofs_frames, header.ofs_gl_commands, header.ofs_end)
+
+
+# returns (st table, st index of every triangle corner) like MD2TextureCoordinates
+def reference_texture_coordinates(snapshot, merge):
+    st_table = []
+    indices = []
+    st_indices = {}
+    for u, v in snapshot.triangle_uvs.reshape(-1, 2).tolist():
+        st = (int(u * MD2Header.skin_width), int((1 - v) * MD2Header.skin_height))
+        if merge:
+            index = st_indices.get(st)
+            if index is None:
+                index = st_indices[st] = len(st_table)
+                st_table.append(st)
+        else:
+            index = len(st_table)
+            st_table.append(st)
+        indices.append(index)
+    return b''.join(struct.pack('<2h', *st) for st in st_table), indices
+
+
+def reference_triangles(snapshot, st_indices):
+    return b''.join(struct.pack('<6H', vertices[0], vertices[2], vertices[1], st_indices[i * 3 + 0],
+                                st_indices[i * 3 + 2], st_indices[i * 3 + 1])
+                    for i, vertices in enumerate(snapshot.triangle_vertices.tolist()))
+
+
+# the strips and fans are built from (vertex, (u, v)) corners and every vertex is packed on its own
+def reference_gl_commands(snapshot):
+    triangles = []
+    for vertices, uvs in zip(snapshot.triangle_vertices.tolist(), snapshot.triangle_uvs.tolist()):
+        triangles.append([(vertices[vert], tuple(uvs[vert])) for vert in [0, 2, 1]])
+    commands = MD2GLCommands.__new__(MD2GLCommands)
+    commands.commands = []
+    commands.build(triangles)
+
+    data = b''
+    for count, corners in commands.commands:
+        data += struct.pack('<i', count)
+        for vertex, uv in corners:
+            data += struct.pack('<ffI', uv[0], (1.0 - uv[1]), vertex)
+    return data + struct.pack('<I', 0)
+
+
+def reference_skins(filename, skins, options):
+    data = b''
+    for iSkin, image_filename in enumerate(skins):
+        if options.fCopyTextureSxS:
+            fn_sx_s = os.path.join(os.path.dirname(filename), os.path.basename(image_filename))
+            if iSkin == 0 and options.fNameTextureToMD2Filename:
+                fn_sx_s = os.path.splitext(filename)[0] + os.path.splitext(image_filename)[1]
+            image_filename = fn_sx_s
+        if len(image_filename) > 63 or options.fExportOnlyTextureBasename:
+            image_filename = os.path.basename(image_filename)
+        data += struct.pack('<64s', bytes(image_filename[0:63], encoding='utf8'))
+    return data
+
+
+@pytest.mark.parametrize('uvs', [True, False])
+@pytest.mark.parametrize('merge', [True, False])
+def test_static_sections(uvs, merge):
+    snapshot = create_snapshot(uvs)
+    texture_coordinates = MD2TextureCoordinates(snapshot, merge)
+    gl_commands = MD2GLCommands(snapshot)
+    (st_data, st_indices) = reference_texture_coordinates(snapshot, merge)
+
+    buffer = bytearray(4 * texture_coordinates.num_st)
+    texture_coordinates.write(memoryview(buffer))
+    assert bytes(buffer) == st_data
+    assert texture_coordinates.indices.tolist() == st_indices
+
+    buffer = bytearray(12 * snapshot.num_triangles)
+    MD2.write_triangles(memoryview(buffer), snapshot, texture_coordinates.indices)
+    assert bytes(buffer) == reference_triangles(snapshot, st_indices)
+
+    buffer = bytearray(4 * gl_commands.num_gl_commands)
+    gl_commands.write(memoryview(buffer))
+    assert bytes(buffer) == reference_gl_commands(snapshot)
+
+    header = MD2Header(['skin.png'], snapshot, 7, texture_coordinates.num_st, gl_commands.num_gl_commands)
+    buffer = bytearray(68)
+    header.write(memoryview(buffer))
+    assert bytes(buffer) == reference_header(header)
+
+
+@pytest.mark.parametrize('copy', [True, False])
+@pytest.mark.parametrize('basename', [True, False])
+def test_skins(copy, basename):
+    options = types.SimpleNamespace(fCopyTextureSxS=copy, fNameTextureToMD2Filename=True,
+                                    fExportOnlyTextureBasename=basename)
+    md2 = MD2(options, [])
+    md2.textures = types.SimpleNamespace(deploy=lambda source, destination: None)
+    skins = ['/textures/first.png', '/textures/second.tga', '/' + 'long/' * 16 + 'third.png']
+    filename = '/export/model.md2'
+
+    buffer = bytearray(64 * len(skins))
+    md2.write_skins(memoryview(buffer), filename, skins)
+    assert bytes(buffer) == reference_skins(filename, skins, options)
@@ -0,0 +1,108 @@
+# The VRML exporters leave out interpolator keys which the interpolation of the kept keys reproduces within the
+# tolerance. These tests reduce sampled positions and orientations and check the error of every dropped key.
+import bisect
+import math
+
+import pytest
+
+import vrml_export_258
+import vrml_export_263
+
+
+def axis_angle(axis, angle):
+    norm = math.sqrt(sum(x * x for x in axis))
+    return (math.cos(angle / 2.0),) + tuple(x / norm * math.sin(angle / 2.0) for x in axis)
+
+
+def multiply(a, b):
+    (w1, x1, y1, z1) = a
+    (w2, x2, y2, z2) = b
+    return (w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+            w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2)
+
+
+# a body which slides, bounces with a decaying height and spins with a wobble, then settles
+def create_samples(count):
+    positions = []
+    quats = []
+    for i in range(count):
+        t = i / 25.0
+        positions.append((0.5 * t if t < 20.0 else 10.0, 0.0, abs(math.sin(t)) * math.exp(-t / 10.0) * 5.0))
+        quat = multiply(axis_angle((0.0, 0.0, 1.0), 3.0 * t if t < 30.0 else 90.0),
+                        axis_angle((1.0, 1.0, 0.0), 0.3 * math.sin(t)))
+        # the sign of a decomposed quaternion is arbitrary
+        quats.append(quat if quat[0] >= 0.0 else tuple(-x for x in quat))
+    return positions, quats
+
+
+# the largest error of the samples left out, against the interpolation of the kept keys around them
+def max_dropped_error(values, kept, interpolate, error):
+    worst = 0.0
+    for i in range(len(values)):
+        k = bisect.bisect_right(kept, i) - 1
+        if kept[k] == i:
+            continue
+        (start, end) = (kept[k], kept[k + 1])
+        worst = max(worst, error(values[i], interpolate(values[start], values[end], (i - start) / (end - start))))
+    return worst
+
+
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+@pytest.mark.parametrize('tolerance', [1e-4, 1e-2, 0.5])
+def test_dropped_positions_within_tolerance(module, tolerance):
+    (positions, _) = create_samples(2000)
+
+    kept = module.reduceKeys(positions, module.lerp, module.distance, tolerance)
+
+    assert kept[0] == 0 and kept[-1] == len(positions) - 1
+    assert kept == sorted(set(kept))
+    assert len(kept) < len(positions)
+    assert max_dropped_error(positions, kept, module.lerp, module.distance) <= tolerance
+
+
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+@pytest.mark.parametrize('tolerance_deg', [0.01, 0.5, 5.0])
+def test_dropped_orientations_within_tolerance(module, tolerance_deg):
+    (_, quats) = create_samples(2000)
+    module.makeHemisphereContinuous(quats)
+    tolerance = math.radians(tolerance_deg)
+
+    kept = module.reduceKeys(quats, module.slerp, module.angleBetween, tolerance)
+
+    assert kept[0] == 0 and kept[-1] == len(quats) - 1
+    assert len(kept) < len(quats)
+    assert max_dropped_error(quats, kept, module.slerp, module.angleBetween) <= tolerance
+
+
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+def test_hemisphere_continuous(module):
+    (_, quats) = create_samples(2000)
+
+    module.makeHemisphereContinuous(quats)
+
+    assert all(sum(a * b for a, b in zip(q0, q1)) >= 0.0 for q0, q1 in zip(quats, quats[1:]))
+
+
+# slerp rotates at a constant rate on the shortest path: a fraction t of the angle from q0, the rest to q1
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+@pytest.mark.parametrize('angle', [1e-3, 0.5, 3.0])
+@pytest.mark.parametrize('t', [0.0, 0.25, 0.7, 1.0])
+def test_slerp_constant_rate(module, angle, t):
+    q0 = axis_angle((1.0, 2.0, 3.0), 0.4)
+    q1 = multiply(axis_angle((0.0, 1.0, -1.0), angle), q0)
+
+    for other in (q1, tuple(-x for x in q1)):
+        q = module.slerp(q0, other, t)
+        assert math.sqrt(sum(x * x for x in q)) == pytest.approx(1.0)
+        assert module.angleBetween(q0, q) == pytest.approx(t * angle, abs=1e-6)
+        assert module.angleBetween(q, q1) == pytest.approx((1.0 - t) * angle, abs=1e-6)
+
+
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+def test_keys_kept_without_tolerance_or_animation(module):
+    (positions, _) = create_samples(50)
+
+    assert module.reduceKeys(positions, module.lerp, module.distance, 0.0) == list(range(50))
+    assert module.reduceKeys([(1.0, 2.0, 3.0)] * 5, module.lerp, module.distance, 0.1) == [0, 4]
@@ -0,0 +1,104 @@
+# The VRML exporters write the geometry with writeRows, in joined chunks. These tests keep the original writer, one
+# write per number, as the reference and compare the written text of both for every geometry section.
+import io
+import random
+
+import pytest
+
+import vrml_export_258
+import vrml_export_263
+
+
+# random vertex positions, triangles and quads with their texture coordinates
+def create_mesh(num_vertices, num_faces, seed):
+    rng = random.Random(seed)
+    co = [(rng.uniform(-9.0, 9.0), rng.uniform(-9.0, 9.0), rng.random() * 1e-4) for _ in range(num_vertices)]
+    faces = [tuple(rng.randrange(num_vertices) for _ in range(rng.choice((3, 4)))) for _ in range(num_faces)]
+    uvs = [[(rng.random(), rng.random()) for _ in face] for face in faces]
+    return co, faces, uvs
+
+
+# the geometry writer before the chunks: texture coordinates, their indices, coordIndex and the coordinates
+def write_reference(flVRML, co, faces, uvs, precisionUV, precisionXYZ):
+    iTexCoord = 0
+    rgTexIndex = []
+    sPrecUV = 2 * ("%%.%if " % precisionUV) + ", "
+    for texFace in uvs:
+        rgLocIndex = []
+        for uv in texFace:
+            rgLocIndex.append(iTexCoord)
+            iTexCoord += 1
+            flVRML.write(sPrecUV % tuple(uv))
+        rgTexIndex.append(tuple(rgLocIndex))
+    flVRML.write("|")
+    for texIndexFace in rgTexIndex:
+        for texIndex in texIndexFace:
+            flVRML.write("%i " % texIndex)
+        flVRML.write("-1 ")
+    flVRML.write("|")
+    for face in faces:
+        for iCoord in face:
+            flVRML.write("%i, " % iCoord)
+        flVRML.write("-1, ")
+    flVRML.write("|")
+    sPrecXYZ = 3 * ("%%.%if " % precisionXYZ) + ", "
+    for vertex in co:
+        flVRML.write(sPrecXYZ % tuple(vertex))
+
+
+# the same sections with writeRows, the rows built like writeObject does
+def write_rows(exporter, flVRML, co, faces, uvs, precisionUV, precisionXYZ):
+    rgTexFaceSize = [len(texFace) for texFace in uvs]
+    exporter.writeRows(flVRML, (tuple(value for uv in texFace for value in uv) for texFace in uvs),
+                       2 * ("%%.%if " % precisionUV) + ", ", 2)
+    flVRML.write("|")
+
+    def rowsTexIndex():
+        iTexCoord = 0
+        for cTexCoords in rgTexFaceSize:
+            yield tuple(range(iTexCoord, iTexCoord + cTexCoords))
+            iTexCoord += cTexCoords
+
+    exporter.writeRows(flVRML, rowsTexIndex(), "%i ", 1, "-1 ")
+    flVRML.write("|")
+    exporter.writeRows(flVRML, (tuple(face) for face in faces), "%i, ", 1, "-1, ")
+    flVRML.write("|")
+    rgCo = [value for vertex in co for value in vertex]
+    cVerticesPerRow = 256
+    exporter.writeRows(flVRML, (tuple(rgCo[i:i + 3 * cVerticesPerRow])
+                                for i in range(0, len(rgCo), 3 * cVerticesPerRow)),
+                       3 * ("%%.%if " % precisionXYZ) + ", ", 3)
+
+
+# counts around the chunk size of 4096 rows and the row size of 256 vertices
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+@pytest.mark.parametrize('num_vertices, num_faces', [(0, 0), (5, 3), (257, 4096), (1000, 4097), (9000, 20000)])
+@pytest.mark.parametrize('precisionUV, precisionXYZ', [(4, 6), (1, 13)])
+def test_write_rows_matches_reference(module, num_vertices, num_faces, precisionUV, precisionXYZ):
+    (co, faces, uvs) = create_mesh(max(num_vertices, 1), num_faces, seed=num_faces)
+    co = co[:num_vertices]
+    reference = io.StringIO()
+    written = io.StringIO()
+
+    write_reference(reference, co, faces, uvs, precisionUV, precisionXYZ)
+    write_rows(module.Export_VRML(), written, co, faces, uvs, precisionUV, precisionXYZ)
+
+    assert written.getvalue() == reference.getvalue()
+
+
+@pytest.mark.parametrize('module', [vrml_export_258, vrml_export_263])
+def test_write_rows_in_chunks(module):
+    class File(io.StringIO):
+        def __init__(self):
+            super().__init__()
+            self.writes = 0
+
+        def write(self, text):
+            self.writes += 1
+            return super().write(text)
+
+    flVRML = File()
+    module.Export_VRML().writeRows(flVRML, ((i, i + 1, i + 2) for i in range(10000)), "%i, ", 1, "-1, ", 4096)
+
+    assert flVRML.writes == 3
+    assert flVRML.getvalue() == "".join("%i, %i, %i, -1, " % (i, i + 1, i + 2) for i in range(10000))
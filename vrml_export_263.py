@@ -31,8 +31,7 @@ bl_info = {
     "category": "Import-Export"}
 
 # open TODOs:
-#   DEF/ USE for reuse of materials and textures (when using multiple objects)
-#   pack animations (e.g. only export at keys)
+#   DEF/ USE for reuse of textures (when using multiple objects)
 
 import bpy
 from bpy.props import *
@@ -46,6 +45,241 @@ import mathutils
 import struct
 import random
 import os
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# copies the textures next to the exported file on a thread pool, while the geometry
+# is written. Every destination is copied once per export. A copy is skipped if the
+# destination has the size and modification time of the source already (copies keep
+# the modification time) or, failing that, the same content.
+class TextureDeployment:
+	def __init__(self, cThreads = 4):
+		self.executor = ThreadPoolExecutor(cThreads)
+		# destination -> (source, destination, future of the copy)
+		self.mapCopies = {}
+
+	def deploy(self, fnSource, fnDestination):
+		fnSource = os.path.abspath(fnSource)
+		fnDestination = os.path.abspath(fnDestination)
+		key = os.path.normcase(fnDestination)
+		if key in self.mapCopies:
+			if self.mapCopies[key][0] != fnSource:
+				print("Texture %s not copied, %s is copied to %s already." %
+					(fnSource, self.mapCopies[key][0], fnDestination))
+			return
+		self.mapCopies[key] = (fnSource, fnDestination,
+			self.executor.submit(TextureDeployment.copy, fnSource, fnDestination))
+
+	# copies the file unless the destination is up to date, returns whether it was copied
+	@staticmethod
+	def copy(fnSource, fnDestination):
+		if os.path.normcase(fnSource) == os.path.normcase(fnDestination):
+			return False
+		if os.path.exists(fnDestination):
+			statSource = os.stat(fnSource)
+			statDestination = os.stat(fnDestination)
+			if statSource.st_size == statDestination.st_size:
+				if int(statSource.st_mtime) == int(statDestination.st_mtime):
+					return False
+				if TextureDeployment.getHash(fnSource) == TextureDeployment.getHash(fnDestination):
+					# same content: the modification time makes the next check cheap
+					shutil.copystat(fnSource, fnDestination)
+					return False
+		shutil.copy2(fnSource, fnDestination)
+		return True
+
+	@staticmethod
+	def getHash(fn, cbChunk = 2**20):
+		digest = hashlib.sha1()
+		with open(fn, "rb") as fl:
+			for chunk in iter(lambda: fl.read(cbChunk), b""):
+				digest.update(chunk)
+		return digest.digest()
+
+	# waits for all copies and reports them
+	def finish(self):
+		cCopied = 0
+		cFailed = 0
+		for fnSource, fnDestination, future in self.mapCopies.values():
+			try:
+				cCopied += future.result()
+			except Exception:
+				print("Could not copy texture %s to %s." % (fnSource, fnDestination))
+				cFailed += 1
+		self.executor.shutdown(wait = True)
+		if self.mapCopies:
+			print("Textures: %i copied, %i up to date" %
+				(cCopied, len(self.mapCopies) - cCopied - cFailed))
+		self.mapCopies = {}
+
+
+# samples the world matrices of objects that are animated only through the fcurves of
+# their actions and object parenting, by evaluating the fcurves directly instead of
+# setting the frame of the scene (which evaluates every modifier and mesh)
+class FCurveTransforms:
+	def __init__(self, rgFrames):
+		self.rgFrames = rgFrames
+		# object name -> world matrix for every frame
+		self.mapWorldMatrices = {}
+
+	# whether the world matrix of obj (and its parents) only depends on its fcurves:
+	# drivers, constraints, NLA and non-object parents need the full scene update
+	@staticmethod
+	def isSupported(obj):
+		while obj:
+			if obj.constraints or obj.parent_type != "OBJECT" or obj.use_slow_parent:
+				return False
+			anim = obj.animation_data
+			if anim:
+				if anim.drivers or anim.nla_tracks:
+					return False
+				if anim.action:
+					for fcurve in anim.action.fcurves:
+						if fcurve.data_path.startswith("delta_"):
+							return False
+			obj = obj.parent
+		return True
+
+	# the local (basis) matrix of obj from its transform values
+	@staticmethod
+	def getBasisMatrix(obj, location, rotation, scale):
+		if obj.rotation_mode == "QUATERNION":
+			matRotation = mathutils.Quaternion(rotation).normalized().to_matrix()
+		elif obj.rotation_mode == "AXIS_ANGLE":
+			matRotation = mathutils.Quaternion(rotation[1:], rotation[0]).to_matrix()
+		else:
+			matRotation = mathutils.Euler(rotation, obj.rotation_mode).to_matrix()
+		return (mathutils.Matrix.Translation(location) * matRotation.to_4x4() *
+			mathutils.Matrix.Scale(scale[0], 4, (1.0, 0.0, 0.0)) *
+			mathutils.Matrix.Scale(scale[1], 4, (0.0, 1.0, 0.0)) *
+			mathutils.Matrix.Scale(scale[2], 4, (0.0, 0.0, 1.0)))
+
+	@staticmethod
+	def getRotationPath(obj):
+		if obj.rotation_mode == "QUATERNION":
+			return "rotation_quaternion"
+		if obj.rotation_mode == "AXIS_ANGLE":
+			return "rotation_axis_angle"
+		return "rotation_euler"
+
+	# the transform values of obj for every frame, keyed channels from their fcurves
+	def getTransforms(self, obj):
+		mapChannels = {}
+		for sPath in ("location", self.getRotationPath(obj), "scale"):
+			value = list(getattr(obj, sPath))
+			mapChannels[sPath] = [list(value) for iFrame in self.rgFrames]
+		anim = obj.animation_data
+		if anim and anim.action:
+			for fcurve in anim.action.fcurves:
+				if fcurve.mute or fcurve.data_path not in mapChannels:
+					continue
+				for value, iFrame in zip(mapChannels[fcurve.data_path], self.rgFrames):
+					value[fcurve.array_index] = fcurve.evaluate(iFrame)
+		return zip(mapChannels["location"], mapChannels[self.getRotationPath(obj)],
+			mapChannels["scale"])
+
+	# the world matrices of obj for every frame (parents are composed once and cached)
+	def getWorldMatrices(self, obj):
+		if obj.name in self.mapWorldMatrices:
+			return self.mapWorldMatrices[obj.name]
+		rgMatrices = [self.getBasisMatrix(obj, location, rotation, scale)
+			for location, rotation, scale in self.getTransforms(obj)]
+		if obj.parent:
+			rgParentMatrices = self.getWorldMatrices(obj.parent)
+			rgMatrices = [matParent * obj.matrix_parent_inverse * matBasis
+				for matParent, matBasis in zip(rgParentMatrices, rgMatrices)]
+		self.mapWorldMatrices[obj.name] = rgMatrices
+		return rgMatrices
+
+	# compares the composed matrix of the current frame with the one of blender, in
+	# case something we don't know about (e.g. delta transforms) moves the object
+	def matchesScene(self, obj, iFrameCurrent, rTolerance = 1e-4):
+		if iFrameCurrent not in self.rgFrames:
+			return True
+		matrix = self.getWorldMatrices(obj)[self.rgFrames.index(iFrameCurrent)]
+		for rowComposed, rowScene in zip(matrix, obj.matrix_world):
+			for a, b in zip(rowComposed, rowScene):
+				if abs(a - b) > rTolerance * max(1.0, abs(b)):
+					return False
+		return True
+
+
+# splits world matrices into the translations, orientations (quaternions) and scales
+# of all frames, with one decomposition per matrix
+def decomposeMatrices(rgMatrices):
+	rgDecomposed = [matrix.decompose() for matrix in rgMatrices]
+	return ([location.to_tuple() for location, quat, scale in rgDecomposed],
+		[tuple(quat) for location, quat, scale in rgDecomposed],
+		[scale.to_tuple() for location, quat, scale in rgDecomposed])
+
+
+# interpolation of the keys, as done by the VRML interpolators: linear for positions
+# and scales, spherical (on the shortest path) for the orientations (as quaternions)
+def lerp(a, b, t):
+	return tuple(x + (y - x) * t for x, y in zip(a, b))
+
+def slerp(q0, q1, t):
+	rDot = sum(x * y for x, y in zip(q0, q1))
+	if rDot < 0.0:
+		q1 = tuple(-x for x in q1)
+		rDot = -rDot
+	if rDot > 0.9995:
+		# (almost) the same orientation: lerp is precise enough and stable
+		q = lerp(q0, q1, t)
+		rNorm = math.sqrt(sum(x * x for x in q))
+		return tuple(x / rNorm for x in q)
+	rAngle = math.acos(rDot)
+	rSin = math.sin(rAngle)
+	r0 = math.sin((1.0 - t) * rAngle) / rSin
+	r1 = math.sin(t * rAngle) / rSin
+	return tuple(x * r0 + y * r1 for x, y in zip(q0, q1))
+
+def distance(a, b):
+	return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+
+# angle (rad) of the rotation between two orientations
+def angleBetween(q0, q1):
+	rDot = abs(sum(x * y for x, y in zip(q0, q1)))
+	return 2.0 * math.acos(min(rDot, 1.0))
+
+# q and -q are the same orientation: flip the quaternions so that each one lies in
+# the hemisphere of its predecessor, otherwise interpolating them takes the long way
+def makeHemisphereContinuous(rgQuats):
+	for i in range(1, len(rgQuats)):
+		if sum(x * y for x, y in zip(rgQuats[i - 1], rgQuats[i])) < 0.0:
+			rgQuats[i] = tuple(-x for x in rgQuats[i])
+
+def isAnimated(rgValues, fnError, rTolerance):
+	return any(fnError(value, rgValues[0]) > rTolerance for value in rgValues)
+
+# returns the indices of the samples to keep as keys (Douglas-Peucker): interpolating
+# between the kept samples reproduces every sample left out within rTolerance.
+# A tolerance of 0 keeps all samples.
+def reduceKeys(rgValues, fnInterpolate, fnError, rTolerance):
+	cValues = len(rgValues)
+	if cValues < 3 or rTolerance <= 0.0:
+		return list(range(cValues))
+
+	rgKeep = [False] * cValues
+	rgKeep[0] = rgKeep[-1] = True
+	rgSegments = [(0, cValues - 1)]
+	while rgSegments:
+		iStart, iEnd = rgSegments.pop()
+		iWorst = None
+		rErrorWorst = rTolerance
+		for i in range(iStart + 1, iEnd):
+			t = (i - iStart) / float(iEnd - iStart)
+			rError = fnError(rgValues[i], fnInterpolate(rgValues[iStart], rgValues[iEnd], t))
+			if rError > rErrorWorst:
+				iWorst = i
+				rErrorWorst = rError
+		if iWorst is not None:
+			rgKeep[iWorst] = True
+			rgSegments.append((iStart, iWorst))
+			rgSegments.append((iWorst, iEnd))
+	return [i for i in range(cValues) if rgKeep[i]]
 
 
 class Export_VRML(bpy.types.Operator):
@@ -62,6 +296,9 @@ class Export_VRML(bpy.types.Operator):
 """ % bl_info["version"]
 
 	rgCachedMaterials = []
+	# geometry key per object name, and DEF name per key of the shared geometries
+	mapGeometryKeys = {}
+	mapGeometryDEFs = {}
 
 	templateMatNode = """
 					material DEF %(name)s Material 
@@ -110,8 +347,82 @@ class Export_VRML(bpy.types.Operator):
 				 default = ((bpy.context.scene.frame_end - bpy.context.scene.frame_start+1) / float(bpy.context.scene.frame_step * bpy.context.scene.render.fps)),
 				 min = 0.0,
 				 description = "How long the animation (one loop) should last (in seconds).")
+	fFastTransforms = BoolProperty(name = "Fast transform sampling",
+				 default = True,
+				 description = "Evaluate the fcurves of objects animated only by their actions and parenting instead of updating the scene for every frame (drivers, constraints and NLA fall back to the scene update)")
+	rKeyTolerance = FloatProperty(name = "Key tolerance",
+				 default = 0.0001, min = 0.0,
+				 description = "How far positions and scales may deviate from the sampled frames when leaving out keys (0 keeps all frames).")
+	rKeyToleranceAngle = FloatProperty(name = "Key tolerance (deg)",
+				 default = 0.05, min = 0.0, max = 180.0,
+				 description = "How far orientations may deviate from the sampled frames when leaving out keys (0 keeps all frames).")
 			
 
+	# writes rows of values: sItem formats cValuesPerItem values of a row, sRowEnd
+	# closes every row. The rows are formatted with one template per row length and
+	# written in chunks of cRowsPerChunk rows instead of one write per number.
+	def writeRows(self, flVRML, rows, sItem, cValuesPerItem, sRowEnd = "", cRowsPerChunk = 4096):
+		mapTemplates = {}
+		rgChunk = []
+		for row in rows:
+			template = mapTemplates.get(len(row))
+			if template is None:
+				template = sItem * (len(row) // cValuesPerItem) + sRowEnd
+				mapTemplates[len(row)] = template
+			rgChunk.append(template % row)
+			if len(rgChunk) == cRowsPerChunk:
+				flVRML.write("".join(rgChunk))
+				rgChunk = []
+		if rgChunk:
+			flVRML.write("".join(rgChunk))
+
+	# writes an interpolator node for the given keys and values and routes it from
+	# the timer to the field of the object
+	def writeInterpolator(self, flVRML, sNode, sDEF, rgKeys, rgValues, sPrecValue,
+			timerDEF, objDEF, sField):
+		flVRML.write("""\nDEF %s %s {
+						key [ """ % (sDEF, sNode))
+		sPrecKEY = ("%%.%if "% self.precisionKey) + ", "
+		self.writeRows(flVRML, ((key,) for key in rgKeys), sPrecKEY, 1)
+		flVRML.write("]\n keyValue [ ") 
+		self.writeRows(flVRML, rgValues, sPrecValue, len(rgValues[0]))
+		flVRML.write("]\n}\n")
+
+		# and now route the animation.
+		flVRML.write("ROUTE %s.fraction_changed TO %s.set_fraction\n" % (timerDEF, sDEF))
+		flVRML.write("ROUTE %s.value_changed TO %s.%s\n" % (sDEF, objDEF, sField))
+
+	def getTexture(self, obj):
+		fnTexture = None
+		for mat in obj.data.materials:
+			for texSlot in mat.texture_slots:
+				if texSlot and texSlot.texture.type == "IMAGE":
+					# this is now relative to the scene file (important for
+					# copying later)
+					fnTexture = bpy.path.relpath(texSlot.texture.image.filepath)[2:]
+					break
+		return fnTexture
+
+	# hash of everything the IndexedFaceSet of obj is written from: objects with the
+	# same key (e.g. linked duplicates, which convert turns into separate meshes)
+	# share one geometry
+	def getGeometryKey(self, obj):
+		fnTexture = self.getTexture(obj)
+		digest = hashlib.sha1()
+		rgCo = [0.0] * (3 * len(obj.data.vertices))
+		obj.data.vertices.foreach_get("co", rgCo)
+		digest.update(struct.pack("<%if" % len(rgCo), *rgCo))
+		# (the fourth index of triangles is 0)
+		rgFaces = [0] * (4 * len(obj.data.tessfaces))
+		obj.data.tessfaces.foreach_get("vertices_raw", rgFaces)
+		digest.update(struct.pack("<%ii" % len(rgFaces), *rgFaces))
+		if fnTexture:
+			uvData = obj.data.tessface_uv_textures[0].data
+			rgUV = [0.0] * (8 * len(uvData))
+			uvData.foreach_get("uv_raw", rgUV)
+			digest.update(struct.pack("<%if" % len(rgUV), *rgUV))
+		return (fnTexture, len(rgCo), len(rgFaces), digest.digest())
+
 	def writeObject(self, flVRML, obj, dirOut):
 
 
@@ -146,43 +457,32 @@ class Export_VRML(bpy.types.Operator):
 
 
 		# see if we also have a texture (as image):
-		fnTexture = None
-		for mat in obj.data.materials:
-			for texSlot in mat.texture_slots:
-				if texSlot and texSlot.texture.type == "IMAGE":
-					# this is now relative to the scene file (important for
-					# copying later)
-					fnTexture = bpy.path.relpath(texSlot.texture.image.filepath)[2:]
-					break
+		fnTexture = self.getTexture(obj)
 			
 		textureNode = ""
 		if fnTexture:		
-			# a) copy the texture
-			import os.path
-			import shutil
+			# a) copy the texture (in the background, once per texture)
 			# path to blender scene is this:
 			fnBlend = bpy.data.filepath
-			try:
-				shutil.copy2(os.path.join(os.path.dirname(fnBlend), fnTexture),
-					os.path.join(dirOut, os.path.basename(fnTexture)))
-			except: 
-				print("Could not copy texture.")
+			self.textures.deploy(os.path.join(os.path.dirname(fnBlend), fnTexture),
+				os.path.join(dirOut, os.path.basename(fnTexture)))
 				
 			# ok -> now tell the VRML that we have a texture:
 			textureNode = 'texture ImageTexture { url "%s" }' % os.path.basename(fnTexture)
 				
 
 		# now deal with the transformation:
+		# (the same decomposition as for the animation)
 		axisAngle = [0.0,0.0,0.0,0.0] # first axis, then angle
-		quat = obj.matrix_world.to_quaternion()
+		location, quat, scale = obj.matrix_world.decompose()
 		axisAngle[0:3] = quat.axis
 		axisAngle[3] = quat.angle
 
 		#tuple(obj.material_slots[0].material.diffuse_color)
 
 		mapValues = { 'name' : obj.name.replace(".", "_"),
-			'scale' : "%.5f %.5f %.5f" % obj.matrix_world.to_scale().to_tuple(),
-			'location' : "%.5f %.5f %.5f" % obj.matrix_world.to_translation().to_tuple(),
+			'scale' : "%.5f %.5f %.5f" % scale.to_tuple(),
+			'location' : "%.5f %.5f %.5f" % location.to_tuple(),
 			'rotation' : "%.5f %.5f %.5f %.5f" % tuple(axisAngle),
 			'materialNode' : materialNode,
 			'textureNode' : textureNode,
@@ -203,7 +503,23 @@ class Export_VRML(bpy.types.Operator):
 			%(materialNode)s
 			%(textureNode)s
 		}
-		geometry IndexedFaceSet {
+""" % mapValues)
+
+		# is the geometry shared with an object written before?
+		key = self.mapGeometryKeys[obj.name]
+		if self.mapGeometryDEFs.get(key):
+			flVRML.write("\t\tgeometry USE %s\n\t} # end of shape " % self.mapGeometryDEFs[key])
+			flVRML.write("\n ] } # end of transform for '%s'\n\n" % obj.name)
+			return
+
+		mapValues['geometryDEF'] = ""
+		if key in self.mapGeometryDEFs:
+			# the first object with a shared geometry defines it
+			self.mapGeometryDEFs[key] = "%s_Geometry" % mapValues['name']
+			mapValues['geometryDEF'] = "DEF %s " % self.mapGeometryDEFs[key]
+
+		flVRML.write(
+"""		geometry %(geometryDEF)sIndexedFaceSet {
 			solid FALSE
 			creaseAngle %(creaseAngle).3f
 """ % mapValues)
@@ -213,30 +529,33 @@ class Export_VRML(bpy.types.Operator):
 		if fnTexture:
 			# ok -> just trying: (BLENDER MUST BE IN OBJECT MODE FOR THIS)
 
-			# dump all faces.
-			iTexCoord = 0
-			rgTexIndex = []
+			# dump all faces, every face has its own texture coordinates.
+			# only the number of coordinates per face is kept for the indices
+			rgTexFaceSize = []
 
 			flVRML.write(" texCoord TextureCoordinate { \n point [ \n")
 			uvData = obj.data.tessface_uv_textures[0].data # shortcut for below.
 
+			def rowsUV():
+				for texFace in uvData:
+					rgUV = [value for uv in texFace.uv for value in uv]
+					rgTexFaceSize.append(len(rgUV) // 2)
+					yield tuple(rgUV)
+
 			sPrecUV = 2*("%%.%if "% self.precisionUV)+ ", "
-			for texFace in uvData:
-				rgLocIndex = []
-				for uv in texFace.uv:
-					rgLocIndex.append(iTexCoord)
-					iTexCoord+=1
-					flVRML.write(sPrecUV % tuple(uv))
-				rgTexIndex.append(tuple(rgLocIndex))
+			self.writeRows(flVRML, rowsUV(), sPrecUV, 2)
 
 			flVRML.write("] \n } \n")
 
-			# now write the indices
+			# now write the indices (the coordinates of the faces follow each other)
+			def rowsTexIndex():
+				iTexCoord = 0
+				for cTexCoords in rgTexFaceSize:
+					yield tuple(range(iTexCoord, iTexCoord + cTexCoords))
+					iTexCoord += cTexCoords
+
 			flVRML.write(" texCoordIndex [ \n" )
-			for texIndexFace in rgTexIndex:
-				for texIndex in texIndexFace:
-					flVRML.write("%i " % texIndex)
-				flVRML.write("-1 ")
+			self.writeRows(flVRML, rowsTexIndex(), "%i ", 1, "-1 ")
 			flVRML.write("\n]\n")
 					
 
@@ -245,16 +564,17 @@ class Export_VRML(bpy.types.Operator):
 		######### XYZ COORDS ###########
 		# ok, now on to the actual coordinates of the mesh etc.
 		flVRML.write("coordIndex [\n ")
-		for face in obj.data.tessfaces:
-			for iCoord in face.vertices:
-				flVRML.write("%i, " % iCoord)
-			flVRML.write("-1, ")
+		self.writeRows(flVRML, (tuple(face.vertices) for face in obj.data.tessfaces), "%i, ", 1, "-1, ")
 
 		flVRML.write("] \n coord Coordinate { point [\n ")
 
+		# all coordinates at once, formatted in rows of cVerticesPerRow vertices
+		rgCo = [0.0] * (3 * len(obj.data.vertices))
+		obj.data.vertices.foreach_get("co", rgCo)
+		cVerticesPerRow = 256
 		sPrecXYZ = 3*("%%.%if "% self.precisionXYZ) + ", "
-		for vertex in obj.data.vertices:
-			flVRML.write(sPrecXYZ % tuple(vertex.co))
+		self.writeRows(flVRML, (tuple(rgCo[i:i + 3 * cVerticesPerRow])
+			for i in range(0, len(rgCo), 3 * cVerticesPerRow)), sPrecXYZ, 3)
 			
 		# close the geometry, and off we go!
 		flVRML.write("""]
@@ -312,6 +632,17 @@ class Export_VRML(bpy.types.Operator):
 		print("Exporting geometry...")
 
 		self.rgCachedMaterials = []
+		# find the objects with the same geometry first, only those need a DEF
+		self.mapGeometryKeys = {}
+		self.mapGeometryDEFs = {}
+		setKeys = set()
+		for obj in context.selected_objects:
+			key = self.getGeometryKey(obj)
+			if key in setKeys:
+				self.mapGeometryDEFs[key] = None
+			setKeys.add(key)
+			self.mapGeometryKeys[obj.name] = key
+		self.textures = TextureDeployment()
 		for obj in context.selected_objects:
 			print("   ...'%s'" % obj.name)
 
@@ -326,33 +657,39 @@ class Export_VRML(bpy.types.Operator):
 			
 
 			print("Exporting animations...")
-			# save the affine transformation for every exported object
-			mapObjRotation = {}
-			mapObjTranslation = {}
-			mapObjScale = {}
-			for iFrame in range(self.iAnimFrameStart, self.iAnimFrameStop+1, self.iAnimStep):
-				scene.frame_set(iFrame)
-				# bl 2011-10-18 - for now this is rather stupid - it dumps everything...
-				# get the position of each object
-				# get the rotation of each object
-				# get the scale of each object
-
+			# save the world matrix of every exported object for every frame, they
+			# are decomposed per object afterwards
+			mapObjMatrices = {}
+
+			rgFrames = list(range(self.iAnimFrameStart, self.iAnimFrameStop+1, self.iAnimStep))
+			transforms = None
+			if self.fFastTransforms and all(FCurveTransforms.isSupported(obj)
+					for obj in context.selected_objects):
+				transforms = FCurveTransforms(rgFrames)
+				if not all(transforms.matchesScene(obj, scene.frame_current)
+						for obj in context.selected_objects):
+					print("   ...transforms differ from the scene, updating the scene for every frame")
+					transforms = None
+
+			if transforms:
+				# all frames at once from the fcurves, the scene stays at the current frame
 				for obj in context.selected_objects:
-					
-					if obj.name not in mapObjRotation.keys():
-						mapObjRotation[obj.name] = []
-						mapObjTranslation[obj.name] = []
-						mapObjScale[obj.name] = []
-
-					axisAngle = [0.0,0.0,0.0,0.0] # first axis, then angle
-					quat = obj.matrix_world.to_quaternion()
-					axisAngle[0:3] = quat.axis
-					axisAngle[3] = quat.angle
-
-
-					mapObjRotation[obj.name].append(tuple(axisAngle))
-					mapObjTranslation[obj.name].append(obj.matrix_world.to_translation().to_tuple())
-					mapObjScale[obj.name].append(obj.matrix_world.to_scale().to_tuple())
+					mapObjMatrices[obj.name] = transforms.getWorldMatrices(obj)
+			else:
+				rgSamples = []
+				for obj in context.selected_objects:
+					mapObjMatrices[obj.name] = []
+					rgSamples.append((obj, mapObjMatrices[obj.name]))
+				for iFrame in rgFrames:
+					scene.frame_set(iFrame)
+					# bl 2011-10-18 - for now this is rather stupid - it dumps everything...
+					# get the position of each object
+					# get the rotation of each object
+					# get the scale of each object
+
+					# copies: matrix_world follows the object when the frame changes
+					for obj, rgMatrices in rgSamples:
+						rgMatrices.append(obj.matrix_world.copy())
 
 			# ok - now we have all affine transforms per object.
 			# we further need one timer: #TODO exchange the cycle interval with Hz+FrameDuration
@@ -372,76 +709,43 @@ class Export_VRML(bpy.types.Operator):
 
 				print("   ...exporting animation of '%s'" % obj.name)
 				objDEF = obj.name.replace(".", "_")
-				sPrecKEY = ("%%.%if "% self.precisionKey) + ", "
 				sPrecXYZW = 4*("%%.%if "% self.precisionXYZ) + ", "
 				sPrecXYZ = 3*("%%.%if "% self.precisionXYZ) + ", "
-				cFrames = len(mapObjRotation[obj.name])
+				# orientations as quaternions (for the interpolation)
+				rgTranslations, rgQuats, rgScales = decomposeMatrices(mapObjMatrices[obj.name])
+				cFrames = len(rgQuats)
 				frameStep = 1.0 / cFrames
 
+				# the samples are uniform, the keys left after the reduction are not
+				rgKeys = []
+				curFramePercentage = 0
+				for iFrame in range(cFrames):
+					rgKeys.append(curFramePercentage)
+					curFramePercentage += frameStep
+
 				# see if se have rotations
-				setRotations = set(mapObjRotation[obj.name])
-				if len(setRotations) > 1:
+				makeHemisphereContinuous(rgQuats)
+				rToleranceAngle = math.radians(self.rKeyToleranceAngle)
+				if isAnimated(rgQuats, angleBetween, rToleranceAngle):
 					# yes, we have different rotations:
-					orIntDEF = "%s_OriInt" % objDEF
-					flVRML.write("""\nDEF %s OrientationInterpolator {
-						key [ """ % orIntDEF)
-
-					curFramePercentage = 0
-					for iFrame in range(cFrames):
-						flVRML.write(sPrecKEY % curFramePercentage) 
-						curFramePercentage += frameStep
-					flVRML.write("]\n keyValue [ ") 
-
-					for axisAngle in mapObjRotation[obj.name]:
-						flVRML.write(sPrecXYZW % axisAngle)
-					flVRML.write("]\n}\n")
-
-					# and now route the animation.
-					flVRML.write("ROUTE %s.fraction_changed TO %s.set_fraction\n" % (timerDEF, orIntDEF))
-					flVRML.write("ROUTE %s.value_changed TO %s.set_rotation\n" % (orIntDEF, objDEF))
-
-				#same for the translation:
-				setTranslations = set(mapObjTranslation[obj.name])
-				if len(setTranslations) > 1:
-					posIntDEF = "%s_PosInt" % objDEF
-					flVRML.write("""\nDEF %s PositionInterpolator {
-						key [ """ % posIntDEF)
-
-					curFramePercentage = 0
-					for iFrame in range(cFrames):
-						flVRML.write(sPrecKEY % curFramePercentage)
-						curFramePercentage += frameStep
-					flVRML.write("]\n keyValue [ ") 
-
-
-					for translation in mapObjTranslation[obj.name]:
-						flVRML.write(sPrecXYZ % translation)
-					flVRML.write("]\n}\n")
-
-					# and now route the animation.
-					flVRML.write("ROUTE %s.fraction_changed TO %s.set_fraction\n" % (timerDEF, posIntDEF))
-					flVRML.write("ROUTE %s.value_changed TO %s.set_translation\n" % (posIntDEF, objDEF))
-
-				# and finally for the scale
-				setScale = set(mapObjScale[obj.name])
-				if len(setScale) > 1:
-					scaleIntDEF = "%s_ScaleInt" % objDEF
-					flVRML.write("""\nDEF %s PositionInterpolator {
-						key [ """ % scaleIntDEF)
-
-					curFramePercentage = 0
-					for iFrame in range(cFrames):
-						flVRML.write(sPrecKEY % curFramePercentage)
-						curFramePercentage += frameStep
-					flVRML.write("]\n keyValue [ ") 
-
-					for scale in mapObjScale[obj.name]:
-						flVRML.write(sPrecXYZ % scale)
-					flVRML.write("]\n}\n")
-
-					# and now route the animation.
-					flVRML.write("ROUTE %s.fraction_changed TO %s.set_fraction\n" % (timerDEF, scaleIntDEF))
-					flVRML.write("ROUTE %s.value_changed TO %s.scale\n" % (scaleIntDEF, objDEF))
+					rgAxisAngles = []
+					rgIndices = reduceKeys(rgQuats, slerp, angleBetween, rToleranceAngle)
+					for i in rgIndices:
+						quat = mathutils.Quaternion(rgQuats[i])
+						rgAxisAngles.append(tuple(quat.axis) + (quat.angle,))
+					self.writeInterpolator(flVRML, "OrientationInterpolator", "%s_OriInt" % objDEF,
+						[rgKeys[i] for i in rgIndices], rgAxisAngles, sPrecXYZW,
+						timerDEF, objDEF, "set_rotation")
+
+				#same for the translation and finally for the scale
+				for rgValues, sDEF, sField in (
+						(rgTranslations, "%s_PosInt" % objDEF, "set_translation"),
+						(rgScales, "%s_ScaleInt" % objDEF, "scale")):
+					if isAnimated(rgValues, distance, self.rKeyTolerance):
+						rgIndices = reduceKeys(rgValues, lerp, distance, self.rKeyTolerance)
+						self.writeInterpolator(flVRML, "PositionInterpolator", sDEF,
+							[rgKeys[i] for i in rgIndices], [rgValues[i] for i in rgIndices], sPrecXYZ,
+							timerDEF, objDEF, sField)
 
 
 
@@ -464,6 +768,9 @@ class Export_VRML(bpy.types.Operator):
 		flVRML.close()
 		self.fnLast = fnVRML
 
+		# the textures were copied meanwhile
+		self.textures.finish()
+
 		self.report({'INFO'},  "Export finished.")
 
 		